@@ -0,0 +1,140 @@
+"""
+Local stand-in for the Virtuoso SPARQL endpoint that answers the queries of the API from a fixtures file.
+
+Usage:
+    python benchmark/fake_sparql.py <fixtures file> [--port 18890] [--latency 0.02]
+
+Queries are recognised by their selected variables and answered with the recorded bindings, through the same
+in-memory index the API uses (helper_index.ElectionIndex). Every answer is delayed by the given latency to mimic the
+round trip to Virtuoso.
+"""
+import argparse
+import asyncio
+import json
+import re
+
+from aiohttp import web
+
+import fixtures
+import helper_index  # noqa: E402, the fixtures module adds the API sources to the path
+import helper_snapshot  # noqa: E402
+
+SELECT = re.compile(r'\bSELECT\s+(?:DISTINCT\s+)?(.*?)\s*WHERE', re.S | re.I)
+VARIABLE = re.compile(r'\?(\w+)')
+IRI = re.compile(r'<([^>]*)>')
+LIMIT = re.compile(r'\bLIMIT\s+(\d+)', re.I)
+OFFSET = re.compile(r'\bOFFSET\s+(\d+)', re.I)
+# Virtuoso's default MaxSortedTopRows: an ORDER BY of the outer query with a larger OFFSET + LIMIT fails with SR353
+MAX_SORTED_TOP_ROWS = 10000
+
+
+class FakeSparql:
+    """Answers SPARQL queries from fixtures."""
+
+    def __init__(self, tables, latency=0):
+        """
+        Keyword arguments:
+        tables -- dictionary that maps the name of every table in helper_snapshot.TABLES to its bindings.
+        latency -- number of seconds every answer is delayed.
+        """
+        self.tables = tables
+        self.latency = latency
+        self.index = helper_index.ElectionIndex(*(tables[name] for name in fixtures.NAMES))
+        self.queries = 0
+
+    def answer(self, query):
+        """
+        Answer a query.
+
+        Returns:
+        The SPARQL JSON result, or None if the query is not recognised.
+        """
+        # The IRIs in the PREFIX declarations are not arguments of the query
+        iris = IRI.findall(re.sub(r'^\s*PREFIX[^\n]*$', '', query, flags=re.M | re.I))
+        # The variables of a paged query are the ones of its ordered subquery
+        select = ([None] + list(SELECT.finditer(query)))[-1]
+        if select is None:
+            if 'ASK' in query.upper():
+                # An ASK without arguments is the probe of helper_health
+                return {'head': {}, 'boolean': self.index.person_exists(iris[0]) if iris else True}
+            return None
+
+        variables = tuple(VARIABLE.findall(select.group(1)))
+        if variables == ('listURI', 'listName'):
+            rows = self.index.lists(iris[0])
+        elif variables == ('personURI', 'name', 'familyName'):
+            rows = self.index.candidates(iris[0])
+        elif variables == ('name', 'familyName', 'listURI', 'listName', 'trackingNb'):
+            rows = self.index.person_info(iris[0])
+        elif variables == ('listURI', 'listName', 'trackingNb', 'personURI', 'name', 'familyName'):
+            rows = [{
+                **list_row,
+                **number,
+                **candidate
+            } for list_row in self.index.lists(iris[0])
+                    for number in self.index.list_numbers(list_row['listURI']['value'])[:1] or ({}, )
+                    for candidate in self.index.candidates(list_row['listURI']['value']) or ({}, )]
+        elif variables == ('person', ):
+            rows = [{'person': {'type': 'uri', 'value': iri}} for iri in iris if self.index.person_exists(iri)]
+        elif variables == ('personURI', 'name', 'familyName', 'listURI', 'listName', 'trackingNb'):
+            rows = [{
+                'personURI': {
+                    'type': 'uri',
+                    'value': iri
+                },
+                **row
+            } for iri in iris for row in self.index.person_info(iri)]
+        else:
+            table = next((name for name, _, table_variables in helper_snapshot.TABLES if table_variables == variables),
+                         None)
+            if table is None:
+                return None
+            rows = self.tables[table]
+
+        offset = OFFSET.search(query)
+        limit = LIMIT.search(query)
+        start = int(offset.group(1)) if offset else 0
+        end = start + int(limit.group(1)) if limit else None
+        outer = query[query.rfind('}'):]
+        if 'ORDER BY' in outer.upper() and end is not None and end > MAX_SORTED_TOP_ROWS:
+            raise ValueError(f'SR353: Sorted TOP clause specifies more then {MAX_SORTED_TOP_ROWS} rows to sort')
+        return {'head': {'vars': list(variables)}, 'results': {'bindings': rows[start:end]}}
+
+    async def handle(self, request):
+        """Handle a SPARQL protocol request with the query as parameter, form field or body."""
+        query = request.query.get('query')
+        if query is None and request.method == 'POST':
+            if request.content_type == 'application/sparql-query':
+                query = await request.text()
+            else:
+                query = (await request.post()).get('query')
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            result = self.answer(query or '')
+        except ValueError as error:
+            return web.Response(status=500, text=f'Virtuoso 22023 Error {error}')
+        if result is None:
+            return web.Response(status=400, text=f'Unknown query: {query}')
+        return web.Response(text=json.dumps(result), content_type='application/sparql-results+json')
+
+    def application(self):
+        """Build the aiohttp application that serves the endpoint at /sparql."""
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route('*', '/sparql', self.handle)
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake SPARQL endpoint from a fixtures file.')
+    parser.add_argument('fixtures', help='Path of the fixtures file.')
+    parser.add_argument('--port', type=int, default=18890, help='Port to listen on.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Number of seconds every answer is delayed.')
+    args = parser.parse_args()
+
+    web.run_app(FakeSparql(fixtures.load(args.fixtures), args.latency).application(),
+                host='127.0.0.1',
+                port=args.port,
+                print=None,
+                access_log=None)
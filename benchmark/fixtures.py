@@ -0,0 +1,112 @@
+"""
+Fixtures for the benchmark: the SPARQL bindings of every table in helper_snapshot.TABLES.
+
+Usage:
+    python benchmark/fixtures.py record <fixtures file>
+    python benchmark/fixtures.py synthetic <fixtures file> [--cities 300] [--lists 8] [--candidates 30]
+
+"record" fetches the bindings from the SPARQL endpoint in SPARQL_URL, "synthetic" generates a dataset of the given size.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+import helper_snapshot  # noqa: E402
+
+NAMES = [name for name, _, _ in helper_snapshot.TABLES]
+
+
+def binding(variable, value):
+    """Build a SPARQL binding for a variable."""
+    return {'type': helper_snapshot.binding_type(variable), 'value': value}
+
+
+def synthetic(cities=300, lists=8, candidates=30, seed=0):
+    """
+    Generate a dataset with a given number of cities, lists per city and candidates per list.
+
+    Returns:
+    A dictionary that maps the name of every table in helper_snapshot.TABLES to its bindings.
+    """
+    rng = random.Random(seed)
+    parties = ['N-VA', 'CD&V', 'Open Vld', 'sp.a', 'Groen', 'Vlaams Belang', 'PVDA', 'Lokaal', 'OK', 'Samen']
+    first_names = ['Bart', 'An', 'Jan', 'Els', 'Tom', 'Sofie', 'Pieter', 'Nabilla', 'Wouter', 'Lies']
+    family_names = ['Peeters', 'Janssens', 'Maes', 'Jacobs', 'Mertens', 'Willems', 'Claes', 'Goossens', 'Wouters']
+    fixtures = {name: [] for name in NAMES}
+
+    for city in range(cities):
+        city_uri = f'http://data.lblod.info/id/werkingsgebieden/benchmark-{city}'
+        fixtures['cities'].append({
+            'cityURI': binding('cityURI', city_uri),
+            'cityName': binding('cityName', f'Gemeente {city}'),
+            'locationLabel': binding('locationLabel', 'Gemeente')
+        })
+        for number in range(1, lists + 1):
+            list_uri = f'http://data.lblod.info/id/kandidatenlijsten/benchmark-{city}-{number}'
+            list_name = rng.choice(parties)
+            fixtures['lists'].append({
+                'cityURI': binding('cityURI', city_uri),
+                'listURI': binding('listURI', list_uri),
+                'listName': binding('listName', list_name)
+            })
+            fixtures['list_numbers'].append({
+                'listURI': binding('listURI', list_uri),
+                'listName': binding('listName', list_name),
+                'trackingNb': binding('trackingNb', str(number))
+            })
+            for candidate in range(candidates):
+                person_uri = f'http://data.lblod.info/id/personen/benchmark-{city}-{number}-{candidate}'
+                fixtures['candidates'].append({
+                    'listURI': binding('listURI', list_uri),
+                    'personURI': binding('personURI', person_uri),
+                    'name': binding('name', rng.choice(first_names)),
+                    'familyName': binding('familyName', rng.choice(family_names))
+                })
+                fixtures['persons'].append({'personURI': binding('personURI', person_uri)})
+    return fixtures
+
+
+def record():
+    """
+    Fetch the dataset from the SPARQL endpoint in SPARQL_URL.
+
+    Returns:
+    A dictionary that maps the name of every table in helper_snapshot.TABLES to its bindings.
+    """
+    return dict(zip(NAMES, asyncio.run(helper_snapshot.fetch_from_sparql())))
+
+
+def load(path):
+    """Read a fixtures file."""
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path, fixtures):
+    """Write a fixtures file."""
+    with open(path, 'w') as file:
+        json.dump(fixtures, file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record or generate fixtures for the benchmark.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record', help='Record the dataset from SPARQL_URL.')
+    record_parser.add_argument('path', help='Path of the fixtures file to write.')
+    synthetic_parser = subparsers.add_parser('synthetic', help='Generate a synthetic dataset.')
+    synthetic_parser.add_argument('path', help='Path of the fixtures file to write.')
+    synthetic_parser.add_argument('--cities', type=int, default=300, help='Number of cities.')
+    synthetic_parser.add_argument('--lists', type=int, default=8, help='Number of lists per city.')
+    synthetic_parser.add_argument('--candidates', type=int, default=30, help='Number of candidates per list.')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        save(args.path, record())
+    else:
+        save(args.path, synthetic(args.cities, args.lists, args.candidates))
@@ -0,0 +1,258 @@
+"""
+Load test of the API against a local fake SPARQL endpoint.
+
+Usage:
+    python benchmark/run.py [--fixtures <fixtures file>] [--concurrency 16] [--requests 2000]
+                            [--latency 0.02] [--endpoint /cities ...] [--env CACHE_SIZE=0 ...]
+                            [--output benchmark.json] [--compare <previous output>] [--workers 1] [--postgres]
+
+The fake SPARQL endpoint (fake_sparql.py) and the API (serve.py) are started as subprocesses. Every endpoint is then
+requested with the given concurrency and the latency percentiles and throughput are written to a JSON file.
+Without --fixtures a synthetic dataset is generated.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import aiohttp
+
+import fixtures
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ['/cities', '/lists', '/cities/overview', '/candidates', '/person', '/get', '/store/']
+
+
+def free_port():
+    """Get a free TCP port on localhost."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=60):
+    """Wait until a subprocess listens on a port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args} exited with code {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'{process.args} did not start listening on port {port}')
+
+
+def wait_for_ready(url, process, timeout=60):
+    """Wait until the API reports that it is ready to serve requests."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args} exited with code {process.returncode}')
+        try:
+            with urllib.request.urlopen(url + '/readyz', timeout=5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'{process.args} did not become ready')
+
+
+class Requests:
+    """Builds random requests for every endpoint from the fixtures."""
+
+    def __init__(self, tables):
+        self.cities = [row['cityURI']['value'] for row in tables['cities']]
+        self.lists = list({row['listURI']['value'] for row in tables['candidates']})
+        self.persons = [row['personURI']['value'] for row in tables['persons']]
+        self.stored = 0
+
+    def build(self, endpoint):
+        """
+        Build a random request for an endpoint.
+
+        Returns:
+        A tuple of the method, the path with query string and the json body.
+        """
+        if endpoint == '/lists':
+            return 'GET', '/lists', {'cityURI': random.choice(self.cities)}, None
+        if endpoint == '/cities/overview':
+            return 'GET', '/cities/overview', {'cityURI': random.choice(self.cities)}, None
+        if endpoint == '/candidates':
+            return 'GET', '/candidates', {'listURI': random.choice(self.lists)}, None
+        if endpoint == '/person':
+            return 'GET', '/person', {'personURI': random.choice(self.persons)}, None
+        if endpoint == '/store/':
+            self.stored += 1
+            body = {
+                'uri': f'https://benchmark-{self.stored}.example.org/profile/card#me',
+                'lblod_id': random.choice(self.persons)
+            }
+            return 'POST', '/store/', None, body
+        return 'GET', endpoint, None, None
+
+
+async def load(session, base_url, requests, endpoint, count, concurrency):
+    """
+    Request an endpoint a number of times with a given concurrency.
+
+    Returns:
+    A dictionary with the latency percentiles in milliseconds, the throughput and the status codes.
+    """
+    latencies, statuses, errors = [], {}, 0
+    remaining = count
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, path, params, body = requests.build(endpoint)
+            start = time.perf_counter()
+            try:
+                async with session.request(method, base_url + path, params=params, json=body) as res:
+                    await res.read()
+                    status = res.status
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))], 3) if latencies else None
+
+    return {
+        'requests': count,
+        'errors': errors,
+        'status': statuses,
+        'throughput': round(len(latencies) / duration, 1),
+        'latency_ms': {
+            'p50': percentile(50),
+            'p95': percentile(95),
+            'p99': percentile(99),
+            'max': round(latencies[-1], 3) if latencies else None
+        }
+    }
+
+
+async def benchmark(base_url, tables, endpoints, count, concurrency, warmup):
+    """Run the load test of every endpoint."""
+    requests = Requests(tables)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        results = {}
+        for endpoint in endpoints:
+            if warmup:
+                await load(session, base_url, requests, endpoint, warmup, concurrency)
+            results[endpoint] = await load(session, base_url, requests, endpoint, count, concurrency)
+            latency = results[endpoint]['latency_ms']
+            print(f'{endpoint:12} {results[endpoint]["throughput"]:>9} req/s   p50 {latency["p50"]:>8} ms   '
+                  f'p95 {latency["p95"]:>8} ms   p99 {latency["p99"]:>8} ms   errors {results[endpoint]["errors"]}')
+        return results
+
+
+def compare(previous, current):
+    """Print the relative change of the throughput and latency percentiles between two outputs."""
+    print('\nChange compared to the previous results:')
+    for endpoint, result in current['endpoints'].items():
+        before = previous.get('endpoints', {}).get(endpoint)
+        if before is None:
+            continue
+        changes = []
+        for name, old, new in [('throughput', before['throughput'], result['throughput'])] + [
+                (p, before['latency_ms'][p], result['latency_ms'][p]) for p in ('p50', 'p95', 'p99')]:
+            if old and new is not None:
+                changes.append(f'{name} {(new - old) / old * 100:+.1f}%')
+        print(f'{endpoint:12} ' + '   '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the API against a fake SPARQL endpoint.')
+    parser.add_argument('--fixtures', help='Fixtures file, a synthetic dataset is generated when omitted.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent requests.')
+    parser.add_argument('--requests', type=int, default=2000, help='Number of requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=100, help='Number of unmeasured requests per endpoint.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency of the fake SPARQL endpoint in seconds.')
+    parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help='Endpoint to test, all by default.')
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE environment variable for the API.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes of the API.')
+    parser.add_argument('--postgres', action='store_true', help='Use the Postgres database configured in PG_*.')
+    parser.add_argument('--output', default='benchmark.json', help='File to write the results to.')
+    parser.add_argument('--compare', help='Previous results file to compare with.')
+    args = parser.parse_args()
+
+    fixtures_path = args.fixtures
+    if fixtures_path is None:
+        fixtures_path = os.path.join(tempfile.mkdtemp(prefix='solid-elections-benchmark-'), 'fixtures.json')
+        fixtures.save(fixtures_path, fixtures.synthetic())
+    tables = fixtures.load(fixtures_path)
+
+    sparql_port, api_port = free_port(), free_port()
+    env = dict(os.environ, SPARQL_URL=f'http://127.0.0.1:{sparql_port}/sparql')
+    env.update(variable.split('=', 1) for variable in args.env)
+
+    processes = []
+    try:
+        processes.append(
+            subprocess.Popen([
+                sys.executable,
+                os.path.join(DIRECTORY, 'fake_sparql.py'), fixtures_path, '--port',
+                str(sparql_port), '--latency',
+                str(args.latency)
+            ]))
+        wait_for_port(sparql_port, processes[-1])
+        processes.append(
+            subprocess.Popen([sys.executable, os.path.join(DIRECTORY, 'serve.py'), '--port',
+                              str(api_port), '--workers',
+                              str(args.workers)] + (['--postgres'] if args.postgres else []),
+                             env=env))
+        wait_for_ready(f'http://127.0.0.1:{api_port}', processes[-1])
+
+        endpoints = args.endpoint or ENDPOINTS
+        results = asyncio.run(
+            benchmark(f'http://127.0.0.1:{api_port}', tables, endpoints, args.requests, args.concurrency,
+                      args.warmup))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    output = {
+        'config': {
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'sparql_latency': args.latency,
+            'fixtures': {name: len(rows) for name, rows in tables.items()},
+            'env': args.env,
+            'workers': args.workers,
+            'postgres': args.postgres
+        },
+        'endpoints': results
+    }
+    with open(args.output, 'w') as file:
+        json.dump(output, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), output)
+
+
+if __name__ == '__main__':
+    main()
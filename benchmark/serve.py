@@ -0,0 +1,38 @@
+"""
+Start the API for the benchmark.
+
+Usage:
+    python benchmark/serve.py [--port 18000] [--workers 1] [--postgres]
+
+Unless --postgres is given, the API stores its webIDs in a throwaway SQLite database instead of the Postgres database
+configured with the PG_* variables.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from playhouse.pool import PooledSqliteDatabase  # noqa: E402
+
+import models  # noqa: E402
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start the API for the benchmark.')
+    parser.add_argument('--port', type=int, default=18000, help='Port to listen on.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes.')
+    parser.add_argument('--postgres', action='store_true', help='Use the Postgres database configured in PG_*.')
+    args = parser.parse_args()
+
+    if not args.postgres:
+        directory = tempfile.mkdtemp(prefix='solid-elections-benchmark-')
+        models.db = PooledSqliteDatabase(os.path.join(directory, 'benchmark.sqlite'),
+                                         max_connections=models.POOL_SIZE,
+                                         check_same_thread=False,
+                                         pragmas={'journal_mode': 'wal'})
+        models.db.bind([models.WebID, models.SchemaVersion])
+
+    import main
+    main.app.run(host='127.0.0.1', port=args.port, access_log=False, workers=args.workers)
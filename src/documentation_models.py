@@ -13,6 +13,28 @@ class StoreResponse:
     success = doc.Boolean("Boolean reflecting if the right query parameters were available in the request and if they are valid.")
     updated = doc.Boolean("Boolean reflecting whether the webID uri and lblod uri pair is stored in the database.")
     message = doc.String("String that clarifies the response.")
+    pending = doc.Boolean("Only with STORE_WRITE_BEHIND: boolean reflecting whether the pair is still waiting to be stored.")
+    token = doc.String("Only with STORE_WRITE_BEHIND: token to get the outcome from /store/status.")
+
+
+class StoreStatusResponse:
+    success = doc.Boolean("Boolean reflecting if the token is valid and the pair is stored or still pending.")
+    updated = doc.Boolean("Boolean reflecting whether the webID uri and lblod uri pair is stored in the database.")
+    pending = doc.Boolean("Boolean reflecting whether the pair is still waiting to be stored.")
+    message = doc.String("String that clarifies the response.")
+
+
+class StoreBulkResponseEntry:
+    uri = doc.String("The uri of the webID of this item.")
+    lblod_id = doc.String("The uri of the lblod person of this item.")
+    success = doc.Boolean("Boolean reflecting if the item contains both fields and if the lblod uri is valid.")
+    updated = doc.Boolean("Boolean reflecting whether the webID uri and lblod uri pair is stored in the database.")
+    message = doc.String("String that clarifies the outcome of this item.")
+
+
+class StoreBulkResponse:
+    success = doc.Boolean("Boolean reflecting if the request body could be read.")
+    result = doc.List(StoreBulkResponseEntry, "The outcome of every item, in the order of the request.")
 
 
 class GetResponseEntry:
@@ -61,12 +83,44 @@ class CandidateResponse:
 
 
 class PersonResponseEntry:
+    personURI = TypeValuePair
     name = TypeValuePair
     familyName = TypeValuePair
     listURI = TypeValuePair
     listName = TypeValuePair
     trackingNb = TypeValuePair
+    webID = TypeValuePair
 
-class CandidateResponse:
+
+class PersonResponse:
+    success = doc.Boolean("Success of the request.")
+    result = doc.List(PersonResponseEntry, "List of all the list on which the persons are present.")
+
+
+class SearchResponseEntry:
+    kind = TypeValuePair
+    cityURI = TypeValuePair
+    cityName = TypeValuePair
+    locationLabel = TypeValuePair
+    listURI = TypeValuePair
+    listName = TypeValuePair
+    personURI = TypeValuePair
+    name = TypeValuePair
+    familyName = TypeValuePair
+
+
+class SearchResponse:
+    success = doc.Boolean("Success of the request.")
+    result = doc.List(SearchResponseEntry, "List of the best matching cities, lists and candidates.")
+
+
+class OverviewResponseEntry:
+    listURI = TypeValuePair
+    listName = TypeValuePair
+    trackingNb = TypeValuePair
+    candidates = doc.List(CandidateResponseEntry, "List of the candidates of the list.")
+
+
+class OverviewResponse:
     success = doc.Boolean("Success of the request.")
-    result = doc.List(CandidateResponseEntry, "List of all the list on which the person is present.")
+    result = doc.List(OverviewResponseEntry, "List of all the lists of the city with their candidates.")
@@ -0,0 +1,216 @@
+"""
+In-process cache for the results of the SPARQL queries.
+"""
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+from os import environ
+
+
+# Set when a stale value was served while handling the current request, so the response can be marked
+served_stale = ContextVar('served_stale', default=False)
+
+
+class TTLCache:
+    """
+    A size-bounded LRU cache in which every entry expires after its own time to live.
+
+    Concurrent lookups of a key that is not cached are coalesced: only the first lookup computes the value,
+    the others wait for its result. Hits, misses and coalesced lookups are counted per namespace (the first element
+    of the key).
+
+    An expired entry is kept for `stale` more seconds. A lookup in that period gets the stale value immediately
+    while the value is recomputed in the background, so a slow or failing upstream doesn't delay the lookup.
+    """
+
+    def __init__(self, max_size, stale=0):
+        self.max_size = max_size
+        self.stale = stale
+        self.hits = Counter()
+        self.misses = Counter()
+        self.stale_hits = Counter()
+        self.coalesced = Counter()
+        self._entries = OrderedDict()  # key -> (expiry time, value)
+        self._pending = {}  # key -> task that computes the value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Get a value from the cache.
+
+        Keyword arguments:
+        key -- tuple that identifies the value, the first element is the namespace.
+
+        Returns:
+        The cached value, or None if the key is not cached or has expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            if entry[0] + self.stale <= time.monotonic():
+                del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get_stale(self, key):
+        """
+        Get an expired value that may still be served while it is recomputed.
+
+        Keyword arguments:
+        key -- tuple that identifies the value, the first element is the namespace.
+
+        Returns:
+        The expired value, or None if the key is not cached, has not expired or expired more than `stale` seconds ago.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] > time.monotonic() or entry[0] + self.stale <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        """
+        Store a value in the cache, evicting the least recently used entries when the cache is full.
+
+        Keyword arguments:
+        key -- tuple that identifies the value, the first element is the namespace.
+        value -- the value to store.
+        ttl -- number of seconds after which the value expires.
+        """
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, namespace=None, where=None):
+        """
+        Remove entries from the cache.
+
+        Keyword arguments:
+        namespace -- optional namespace of which all the entries will be removed, all entries are removed when omitted.
+        where -- optional function that gets the key of an entry and returns whether to remove it.
+
+        Returns:
+        The number of removed entries.
+        """
+        if namespace is None and where is None:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+        keys = [key for key in self._entries
+                if (namespace is None or key[0] == namespace) and (where is None or where(key))]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    async def get_or_compute(self, key, ttl, compute):
+        """
+        Get a value from the cache, computing and storing it if it is not cached.
+
+        The value is computed in a task of its own, so a lookup that is cancelled, e.g. because its client
+        disconnected, doesn't cancel the computation that other lookups of the same key are waiting for.
+
+        Keyword arguments:
+        key -- tuple that identifies the value, the first element is the namespace.
+        ttl -- number of seconds after which a computed value expires.
+        compute -- function without arguments that returns an awaitable of the value.
+
+        Returns:
+        The cached or computed value. Exceptions raised while computing are propagated to all waiting callers.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits[key[0]] += 1
+            return value
+
+        value = self.get_stale(key)
+        if value is not None:
+            self.stale_hits[key[0]] += 1
+            served_stale.set(True)
+            if key not in self._pending:
+                self._start(key, ttl, compute)
+            return value
+
+        task = self._pending.get(key)
+        if task is None:
+            self.misses[key[0]] += 1
+            task = self._start(key, ttl, compute)
+        else:
+            # Another request is already computing this value
+            self.coalesced[key[0]] += 1
+        return await asyncio.shield(task)
+
+    def _start(self, key, ttl, compute):
+        """Start computing a value in the background, so concurrent lookups of the same key wait for it."""
+        task = asyncio.ensure_future(self._compute(key, ttl, compute))
+        self._pending[key] = task
+        # The exception of a failed computation is handed to the waiting lookups, if there are any
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return task
+
+    async def _compute(self, key, ttl, compute):
+        """Compute and store a value."""
+        try:
+            value = await compute()
+            self.set(key, value, ttl)
+            return value
+        finally:
+            del self._pending[key]
+
+    def stats(self):
+        """
+        Get the hit and miss counters of the cache.
+
+        Returns:
+        A dictionary with keys "size", "max_size", "hits", "misses", "stale_hits" and "coalesced".
+            "hits", "misses", "stale_hits" and "coalesced" are dictionaries that map every namespace to its counter.
+        """
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'stale_hits': dict(self.stale_hits),
+            'coalesced': dict(self.coalesced)
+        }
+
+
+cache = TTLCache(int(environ.get('CACHE_SIZE', 1024)), float(environ.get('CACHE_STALE', 86400)))
+
+
+def ttl_for(namespace):
+    """
+    Get the time to live of a namespace from the environment.
+
+    The TTL is read from CACHE_TTL_<NAMESPACE>, falling back to CACHE_TTL and finally to one hour.
+    """
+    return float(environ.get(f'CACHE_TTL_{namespace.upper()}', environ.get('CACHE_TTL', 3600)))
+
+
+def cached(namespace):
+    """
+    Decorator that caches the result of a coroutine function in the shared cache.
+
+    The result is keyed by the namespace and the positional arguments of the call, so the arguments must be hashable.
+    Callers share the cached result and must not modify it.
+
+    Keyword arguments:
+    namespace -- string that identifies the function in the cache and in the TTL configuration.
+    """
+    ttl = ttl_for(namespace)
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args):
+            return await cache.get_or_compute((namespace, ) + args, ttl, lambda: func(*args))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,86 @@
+"""
+Functions to encode SPARQL results in the response formats of the API.
+"""
+
+# Formats that can be requested with the "format" query parameter of the read endpoints
+FORMATS = ('sparql', 'compact', 'columns')
+
+
+def requested_format(req):
+    """
+    Get the response format that is requested with the "format" query parameter.
+
+    Keyword arguments:
+    req -- the Sanic request.
+
+    Returns:
+    One of FORMATS, "sparql" when the parameter is missing, or None when the format is unknown.
+    """
+    name = req.args.get('format', 'sparql')
+    return name if name in FORMATS else None
+
+
+def compact(rows):
+    """
+    Replace every SPARQL binding of a result by its value.
+
+    Keyword arguments:
+    rows -- list of SPARQL bindings, these are not modified since they can be shared with the cache.
+
+    Returns:
+    A list of objects that map every variable of a row to the value of its binding.
+
+        Example:
+            [
+                {
+                    "cityURI": "http://data.lblod.info/id/bestuurseenheden/81a6c688-9d4e-4905-b5af-c8b2386516e5",
+                    "cityName": "Puurs-Sint-Amands",
+                    "locationLabel": "Gemeente"
+                }
+            ]
+    """
+    return [{variable: binding['value'] for variable, binding in row.items()} for row in rows]
+
+
+def columns(rows):
+    """
+    Encode a SPARQL result as one array of values per variable.
+
+    Keyword arguments:
+    rows -- list of SPARQL bindings, these are not modified since they can be shared with the cache.
+
+    Returns:
+    An object that maps every variable to the list of its values, in the order of the rows.
+        A variable that is not bound in a row, like the optional "webID", has the value null in that row.
+
+        Example:
+            {
+                "cityURI": ["http://data.lblod.info/id/bestuurseenheden/81a6c688-9d4e-4905-b5af-c8b2386516e5"],
+                "cityName": ["Puurs-Sint-Amands"],
+                "locationLabel": ["Gemeente"]
+            }
+    """
+    variables = list(dict.fromkeys(variable for row in rows for variable in row))
+    result = {variable: [None] * len(rows) for variable in variables}
+    for i, row in enumerate(rows):
+        for variable, binding in row.items():
+            result[variable][i] = binding['value']
+    return result
+
+
+def encode(rows, name):
+    """
+    Encode a SPARQL result in a response format.
+
+    Keyword arguments:
+    rows -- list of SPARQL bindings, these are not modified since they can be shared with the cache.
+    name -- one of FORMATS.
+
+    Returns:
+    The rows as they are for "sparql", the result of compact for "compact" and the result of columns for "columns".
+    """
+    if name == 'compact':
+        return compact(rows)
+    if name == 'columns':
+        return columns(rows)
+    return rows
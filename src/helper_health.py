@@ -0,0 +1,173 @@
+"""
+Startup of the API in the background, and the liveness and readiness of a worker.
+
+The server starts listening immediately. Connecting to Postgres, reaching the SPARQL endpoint, loading the
+in-memory index and warming the cache happen in the background with exponential backoff, so /healthz answers while
+the worker is starting and /readyz only reports the worker as ready once it can serve requests.
+"""
+import asyncio
+import random
+import time
+from os import environ
+
+from sanic.log import logger
+
+import helper_index
+import helper_persons
+import helper_sparql
+import models
+
+# Set once the migrations are applied, which means Postgres was reachable at least once
+database_ready = False
+
+# Set once all startup steps have finished, successfully or not
+startup_complete = False
+
+_startup = None
+
+
+def backoff():
+    """
+    Generate the delays between the attempts of a startup step.
+
+    The delay starts at STARTUP_RETRY_DELAY seconds and doubles after every attempt up to STARTUP_RETRY_MAX_DELAY
+    seconds. A random jitter of up to 10% keeps the workers from retrying in lockstep.
+    """
+    delay = float(environ.get('STARTUP_RETRY_DELAY', 0.5))
+    max_delay = float(environ.get('STARTUP_RETRY_MAX_DELAY', 30))
+    while True:
+        yield delay * random.uniform(1, 1.1)
+        delay = min(delay * 2, max_delay)
+
+
+async def prepare_database():
+    """Apply the migrations of the database, retrying until Postgres is reachable."""
+    global database_ready
+    for attempt, delay in enumerate(backoff(), 1):
+        try:
+            # Other workers might be migrating at the same time, a failure is retried like any other
+            versions = await models.run_in_db(models.migrate)
+        except Exception as error:
+            logger.warning(f'Could not prepare the Postgres database (attempt {attempt}), retrying in {delay:.1f}s: '
+                           f'{error}')
+            await asyncio.sleep(delay)
+        else:
+            database_ready = True
+            logger.info(f'Connected to the Postgres database, applied migrations: {versions or "none"}')
+            return
+
+
+async def wait_for_sparql():
+    """Send a trivial query to the SPARQL endpoint, retrying until it answers."""
+    for attempt, delay in enumerate(backoff(), 1):
+        try:
+            await helper_sparql.probe()
+        except Exception as error:
+            logger.warning(f'Could not reach the SPARQL endpoint (attempt {attempt}), retrying in {delay:.1f}s: '
+                           f'{error!r}')
+            await asyncio.sleep(delay)
+        else:
+            logger.info('Connected to the SPARQL endpoint')
+            return
+
+
+async def start_up():
+    """
+    Prepare the database and wait for the SPARQL endpoint, then load the in-memory index or the persons and warm the
+    cache.
+
+    When a snapshot is loaded, the lookups don't need the SPARQL endpoint, so the startup completes without waiting
+    for it. The index is then loaded by the periodic reload once the endpoint is reachable.
+    """
+    global startup_complete
+    sparql = asyncio.ensure_future(wait_for_sparql())
+    try:
+        await prepare_database()
+        if helper_sparql.index is None:
+            await sparql
+        if sparql.done():
+            if helper_index.enabled():
+                await helper_index.load()
+            elif environ.get('LBLOD_REFRESH') and helper_sparql.index is None:
+                await helper_index.refresh()
+            if helper_persons.enabled() and helper_sparql.index is None:
+                await helper_persons.load()
+            if environ.get('CACHE_WARMUP'):
+                try:
+                    await helper_sparql.get_lblod_cities()
+                except Exception:
+                    logger.exception('Could not warm up the cache')
+        startup_complete = True
+        logger.info('Startup complete')
+        await sparql
+    finally:
+        sparql.cancel()
+
+
+def start():
+    """Start up in the background."""
+    global _startup
+    _startup = asyncio.ensure_future(start_up())
+
+
+def stop():
+    """Abort the startup if it is still running."""
+    global _startup
+    if _startup is not None:
+        _startup.cancel()
+        _startup = None
+
+
+def select_one():
+    """Run the cheapest possible query."""
+    models.db.execute_sql('SELECT 1')
+
+
+async def probe(name, check, timeout):
+    """
+    Run a check of an upstream service and measure its latency.
+
+    The error of a failed check is logged. Only its type is returned, since /readyz is not authenticated.
+
+    Keyword arguments:
+    name -- name of the upstream service in the log.
+    check -- function without arguments that returns an awaitable, which raises an exception when the check fails.
+    timeout -- number of seconds after which the check fails.
+
+    Returns:
+    A dictionary with keys "ok" and "latency_ms", and "error" when the check failed.
+    """
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), timeout)
+    except Exception as error:
+        latency = round((time.perf_counter() - start) * 1000, 3)
+        logger.warning(f'The readiness probe of {name} failed: {error!r}')
+        return {'ok': False, 'latency_ms': latency, 'error': type(error).__name__}
+    return {'ok': True, 'latency_ms': round((time.perf_counter() - start) * 1000, 3)}
+
+
+async def readiness():
+    """
+    Check if this worker can serve requests.
+
+    The worker is ready when it has started up and Postgres answers. The SPARQL endpoint only has to answer during
+    the startup, which waits for it unless the lookups are served from an in-memory index or snapshot. Afterwards an
+    outage of the endpoint is reported but doesn't make the worker unready: the cache, the index and the stale results
+    still serve requests, and the circuit breaker answers the others with 503.
+
+    Returns:
+    A tuple of a boolean that is true when the worker is ready and a dictionary with the details of every check.
+    """
+    timeout = float(environ.get('READYZ_TIMEOUT', 2))
+    database, sparql = await asyncio.gather(probe('Postgres', lambda: models.run_in_db(select_one), timeout),
+                                            probe('the SPARQL endpoint', lambda: helper_sparql.probe(timeout), timeout))
+    index = helper_sparql.index is not None
+    ready = startup_complete and database_ready and database['ok']
+    return ready, {
+        'ready': ready,
+        'startup_complete': startup_complete,
+        'database': database,
+        'sparql': sparql,
+        'index': index
+    }
@@ -0,0 +1,98 @@
+"""
+Functions for HTTP conditional requests and caching headers.
+"""
+import hashlib
+from os import environ
+
+from sanic import response
+
+
+def etag(*parts):
+    """
+    Compute a strong entity tag.
+
+    Keyword arguments:
+    parts -- bytes or strings that identify the content, like the serialized body or a dataset version.
+
+    Returns:
+    A quoted entity tag that changes whenever one of the parts changes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return f'"{digest.hexdigest()}"'
+
+
+def variant_etag(tag, encoding):
+    """Get the entity tag of a compressed variant, since a strong tag must differ between representations."""
+    return tag if encoding is None else f'{tag[:-1]}-{encoding}"'
+
+
+def matches(req, tag):
+    """
+    Check if the If-None-Match header of a request matches an entity tag.
+
+    The comparison is weak, as required for If-None-Match, and also accepts the tags of the compressed variants.
+
+    Keyword arguments:
+    req -- the Sanic request.
+    tag -- the entity tag of the uncompressed representation.
+
+    Returns:
+    Boolean reflecting whether or not the client already has the current representation.
+    """
+    header = req.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    base = tag[1:-1]
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        if candidate == base or candidate.startswith(base + '-'):
+            return True
+    return False
+
+
+def cache_control(namespace):
+    """
+    Get the Cache-Control header of an endpoint from the environment.
+
+    The value is read from CACHE_CONTROL_<NAMESPACE>, falling back to CACHE_CONTROL and finally to "no-cache",
+    which lets clients and proxies store the response but makes them revalidate it with its ETag.
+    """
+    return environ.get(f'CACHE_CONTROL_{namespace.upper()}', environ.get('CACHE_CONTROL', 'no-cache'))
+
+
+def caching_headers(namespace, tag, headers=None):
+    """
+    Get the headers that let clients and proxies cache a response.
+
+    Keyword arguments:
+    namespace -- name of the endpoint in the Cache-Control configuration.
+    tag -- the entity tag of the response.
+    headers -- optional dictionary of other headers to include.
+
+    Returns:
+    A new dictionary with the given headers and "ETag" and "Cache-Control".
+    """
+    return dict(headers or {}, ETag=tag, **{'Cache-Control': cache_control(namespace)})
+
+
+def not_modified(namespace, tag, headers=None):
+    """
+    Build the 304 response for a request of which the client already has the current representation.
+
+    Keyword arguments:
+    namespace -- name of the endpoint in the Cache-Control configuration.
+    tag -- the entity tag of the representation.
+    headers -- optional dictionary of other headers to include.
+
+    Returns:
+    A Sanic response with status 304 and the caching headers.
+    """
+    return response.empty(status=304, headers=caching_headers(namespace, tag, headers))
@@ -0,0 +1,492 @@
+"""
+In-memory index of the candidate-list graph, so lookups can be answered without querying the SPARQL database.
+"""
+import asyncio
+import hashlib
+import sys
+import time
+from os import environ
+
+from sanic.log import logger
+
+import helper_cache
+import helper_json
+import helper_metrics
+import helper_queries
+import helper_search
+import helper_sparql
+
+CITIES_QUERY = helper_queries.ALL_CITIES.render()
+LISTS_QUERY = helper_queries.ALL_LISTS.render()
+CANDIDATES_QUERY = helper_queries.ALL_CANDIDATES.render()
+LIST_NUMBERS_QUERY = helper_queries.ALL_LIST_NUMBERS.render()
+PERSONS_QUERY = helper_queries.ALL_PERSONS.render()
+
+
+class ElectionIndex:
+    """
+    Immutable index of cities, lists, candidates and persons.
+
+    All lookups return lists of SPARQL bindings in the same shape as the functions in helper_sparql.
+    The returned rows and bindings are shared between requests, so callers must not modify them.
+    """
+
+    def __init__(self, cities, lists, candidates, list_numbers, persons):
+        """
+        Build the index from the results of the bulk queries.
+
+        Keyword arguments:
+        cities -- bindings of CITIES_QUERY.
+        lists -- bindings of LISTS_QUERY.
+        candidates -- bindings of CANDIDATES_QUERY.
+        list_numbers -- bindings of LIST_NUMBERS_QUERY.
+        persons -- bindings of PERSONS_QUERY.
+        """
+        # Identical bindings (list names, location labels, ...) are stored only once
+        self._bindings = {}
+        self.created = time.time()
+
+        self._cities = [self._row(row, ('cityURI', 'cityName', 'locationLabel')) for row in cities]
+
+        self._lists = {}
+        for row in lists:
+            city_uri = self._value(row['cityURI'])
+            self._lists.setdefault(city_uri, []).append(self._row(row, ('listURI', 'listName')))
+
+        self._candidates = {}
+        names = {}
+        for row in candidates:
+            list_uri = self._value(row['listURI'])
+            person_uri = self._value(row['personURI'])
+            self._candidates.setdefault(list_uri, []).append(self._row(row, ('personURI', 'name', 'familyName')))
+            names.setdefault(person_uri, []).append(self._row(row, ('name', 'familyName', 'listURI')))
+
+        numbers = {}
+        for row in list_numbers:
+            list_uri = self._value(row['listURI'])
+            numbers.setdefault(list_uri, []).append(self._row(row, ('listName', 'trackingNb')))
+
+        self._list_numbers = numbers
+
+        self._person_info = {}
+        for person_uri, person_names in names.items():
+            self._person_info[person_uri] = [{
+                **name,
+                **number
+            } for name in person_names for number in numbers.get(name['listURI']['value'], ())]
+
+        self._persons = frozenset(self._value(row['personURI']) for row in persons)
+        self._bindings = None
+
+    def _value(self, binding):
+        """Get the interned value of a binding."""
+        return sys.intern(binding['value'])
+
+    def _binding(self, binding):
+        """Get the shared copy of a binding with interned strings."""
+        key = (binding['type'], binding['value'])
+        shared = self._bindings.get(key)
+        if shared is None:
+            shared = {'type': sys.intern(binding['type']), 'value': sys.intern(binding['value'])}
+            self._bindings[key] = shared
+        return shared
+
+    def _row(self, row, keys):
+        """Get a row with only the given keys, using shared bindings."""
+        return {key: self._binding(row[key]) for key in keys}
+
+    def cities(self):
+        """Get all the cities, like helper_sparql.get_lblod_cities."""
+        return self._cities
+
+    def lists(self, city_uri):
+        """Get all the lists of a city, like helper_sparql.get_lblod_lists."""
+        return self._lists.get(city_uri, [])
+
+    def candidates(self, list_uri):
+        """Get all the candidates of a list, like helper_sparql.get_lblod_candidates."""
+        return self._candidates.get(list_uri, [])
+
+    def list_numbers(self, list_uri):
+        """Get the names and tracking numbers of a list, as rows with "listName" and "trackingNb"."""
+        return self._list_numbers.get(list_uri, [])
+
+    def person_info(self, person_uri):
+        """Get the info of a person, like helper_sparql.get_lblod_person_info."""
+        return self._person_info.get(person_uri, [])
+
+    def person_exists(self, person_uri):
+        """Check if a person exists, like helper_sparql.lblod_id_exists."""
+        return person_uri in self._persons
+
+    def stats(self):
+        """
+        Get the size of the index.
+
+        Returns:
+        A dictionary with the number of "cities", "lists", "candidates" and "persons" and the "created" timestamp.
+        """
+        return {
+            'created': self.created,
+            'cities': len(self._cities),
+            'lists': sum(len(lists) for lists in self._lists.values()),
+            'candidates': sum(len(candidates) for candidates in self._candidates.values()),
+            'persons': len(self._persons)
+        }
+
+
+def enabled():
+    """Check if the in-memory index is enabled with the LBLOD_INDEX environment variable."""
+    return bool(environ.get('LBLOD_INDEX'))
+
+
+async def build():
+    """
+    Fetch the candidate-list graph from the SPARQL database and build a new index.
+
+    Returns:
+    A new ElectionIndex.
+    """
+    timeout = float(environ.get('LBLOD_INDEX_TIMEOUT', 120))
+    results = await asyncio.gather(*(helper_sparql.make_paged_query(query, timeout=timeout)
+                                     for query in (CITIES_QUERY, LISTS_QUERY, CANDIDATES_QUERY, LIST_NUMBERS_QUERY,
+                                                   PERSONS_QUERY)))
+    # Building takes about a second for a full election, which would stall every request if it ran on the event loop
+    return await asyncio.get_event_loop().run_in_executor(None, ElectionIndex, *results)
+
+
+# Namespaces of the cached lookups that are answered from the candidate-list graph
+NAMESPACES = ('cities', 'lists', 'candidates', 'overview', 'person')
+
+# Fingerprint of the result of every cached lookup in the current version of the dataset, see fingerprints
+_fingerprints = {}
+
+# Digest of the current version of the dataset, and the time at which it was last fetched
+version = None
+refreshed = None
+
+
+def _fingerprint(rows):
+    """Get a short digest of the result of a lookup."""
+    return hashlib.blake2b(helper_json.dumps(rows), digest_size=8).digest()
+
+
+def fingerprints(index):
+    """
+    Fingerprint the result of every lookup that can be answered from an index.
+
+    Keyword arguments:
+    index -- an ElectionIndex or SnapshotIndex.
+
+    Returns:
+    A dictionary that maps the cache key of every lookup of helper_sparql to a digest of its result, in an order that
+    only depends on the order of the rows of the index.
+    """
+    prints = {('cities', ): _fingerprint(index.cities())}
+    # The persons are kept in order of appearance, so the lookups are fingerprinted in the same order by every worker
+    persons = {}
+    for city in index.cities():
+        city_uri = city['cityURI']['value']
+        lists = index.lists(city_uri)
+        prints[('lists', city_uri)] = _fingerprint(lists)
+        overview = [prints[('lists', city_uri)]]
+        for list_row in lists:
+            list_uri = list_row['listURI']['value']
+            candidates = index.candidates(list_uri)
+            prints[('candidates', list_uri)] = _fingerprint(candidates)
+            overview.append(prints[('candidates', list_uri)])
+            overview.append(_fingerprint(index.list_numbers(list_uri)))
+            persons.update((candidate['personURI']['value'], None) for candidate in candidates)
+        prints[('overview', city_uri)] = b''.join(overview)
+    for person_uri in persons:
+        prints[('person', person_uri)] = _fingerprint(index.person_info(person_uri))
+    return prints
+
+
+def _changes(prints, previous):
+    """Get the cache keys of the lookups of which the fingerprint differs between two versions of the dataset."""
+    changed = {key for key, fingerprint in prints.items() if previous.get(key) != fingerprint}
+    changed.update(key for key in previous if key not in prints)
+    return changed
+
+
+def _compare(index, previous, search):
+    """
+    Compare a new version of the dataset with the current one, which takes seconds for a full election.
+
+    Nothing is modified, so this runs in a worker thread while the current version keeps answering requests.
+
+    Keyword arguments:
+    index -- an ElectionIndex or SnapshotIndex with the new version of the dataset.
+    previous -- the fingerprints of the current version.
+    search -- the helper_search.SearchIndex to update, or None when the search index isn't built.
+
+    Returns:
+    A tuple of the fingerprints of the new version, their digest, the keys of the lookups that changed, and a
+    search index with the documents of the new version together with the numbers of added, removed and changed ones,
+    or None and None without a search index.
+    """
+    prints = fingerprints(index)
+    # Sorting the fingerprints would hold the GIL long enough to stall the event loop, their order is stable anyway
+    digest = hashlib.blake2b(digest_size=8)
+    for fingerprint in prints.values():
+        digest.update(fingerprint)
+    digest = digest.hexdigest()
+    counts = None
+    if search is not None:
+        search = search.copy()
+        counts = search.update(helper_search.documents(index))
+    return prints, digest, _changes(prints, previous), search, counts
+
+
+async def track(index, install=False, search=False):
+    """
+    Record a new version of the dataset and invalidate only the cached lookups of which the result changed.
+
+    Cached lookups that the index can't answer, like the candidates of a list that doesn't belong to a city, are
+    invalidated as well, since it is unknown whether they changed. Once the search index is built, it is updated with
+    the changed names. The comparison runs in a worker thread, only the swap and the invalidation run on the event loop.
+
+    Keyword arguments:
+    index -- an ElectionIndex or SnapshotIndex with the new version of the dataset.
+    install -- whether the index answers the lookups from now on, it is swapped in together with the invalidation.
+    search -- whether to build the search index from this version if it isn't built yet.
+
+    Returns:
+    A dictionary that maps every namespace to the number of lookups of which the result changed, or None if another
+    index was installed while this one was compared.
+    """
+    global _fingerprints, version, refreshed
+    previous = _fingerprints
+    current = helper_search.index
+    if current is None and search:
+        current = helper_search.SearchIndex()
+    prints, digest, changed, updated, counts = await asyncio.get_event_loop().run_in_executor(
+        None, _compare, index, previous, current)
+    if not install and helper_sparql.index not in (None, index):
+        return None
+    if _fingerprints is not previous:
+        # Another version was tracked in the meantime
+        changed = _changes(prints, _fingerprints)
+    if install:
+        helper_sparql.index = index
+    helper_cache.cache.invalidate(where=lambda key: key[0] in NAMESPACES and (key in changed or key not in prints))
+
+    changes = {namespace: 0 for namespace in NAMESPACES}
+    for key in changed:
+        changes[key[0]] += 1
+        if version is not None:
+            helper_metrics.DATASET_CHANGES.inc(key[0])
+    if changed or version is None:
+        version = digest
+    _fingerprints = prints
+    refreshed = time.time()
+    helper_metrics.DATASET_REFRESHED.set(refreshed)
+
+    if updated is not None:
+        helper_search.index = updated
+        logger.info(f'LBLOD dataset version {version}, changed lookups: {changes}, search index: {counts[0]} added, '
+                    f'{counts[1]} removed, {counts[2]} changed')
+    else:
+        # A search index that was built from the previous version while this one was compared is out of date
+        helper_search.index = None
+        logger.info(f'LBLOD dataset version {version}, changed lookups: {changes}')
+    return changes
+
+
+async def install(index):
+    """
+    Make an index the one that is used to answer lookups.
+
+    Keyword arguments:
+    index -- the ElectionIndex to use, or None to query the SPARQL database again.
+    """
+    if index is None:
+        helper_sparql.index = None
+        helper_search.index = None
+        # Results cached from the index may be newer than the SPARQL database, or the other way around
+        helper_cache.cache.invalidate()
+    else:
+        # Results cached before the swap stay valid when the new index gives the same result
+        await track(index, install=True)
+
+
+# Task that tracks the version of an index that was installed by install_now
+_tracker = None
+
+
+def install_now(index):
+    """
+    Make an index the one that is used to answer lookups right away, and track its version in the background.
+
+    Cached lookups are only invalidated once the version is tracked, so this is meant for an index that is installed
+    before anything is cached, like a snapshot when the server starts.
+
+    Keyword arguments:
+    index -- the ElectionIndex or SnapshotIndex to use.
+    """
+    global _tracker
+    helper_sparql.index = index
+    _tracker = asyncio.ensure_future(track(index))
+
+
+async def load():
+    """
+    Build a new index and swap it in atomically.
+
+    Returns:
+    Boolean reflecting whether the index was loaded. The previous index is kept when loading fails.
+    """
+    try:
+        index = await build()
+    except Exception:
+        logger.exception('Could not load the LBLOD index')
+        return False
+    await install(index)
+    logger.info(f'Loaded the LBLOD index: {index.stats()}')
+    return True
+
+
+async def refresh(search=False):
+    """
+    Fetch the dataset and invalidate the cached lookups that changed, without answering lookups from it.
+
+    This keeps the results cached from the SPARQL database fresh when the in-memory index is disabled. Nothing is
+    fetched while lookups are answered from an index, like a snapshot, since the fetched dataset would then be
+    tracked as the version of the dataset even though it isn't the one that is served.
+
+    Keyword arguments:
+    search -- whether to build the search index from the dataset if it isn't built yet.
+
+    Returns:
+    Boolean reflecting whether the dataset was fetched.
+    """
+    if helper_sparql.index is not None:
+        logger.warning('Not refreshing the LBLOD dataset, since lookups are answered from an index or snapshot')
+        return False
+    try:
+        index = await build()
+    except Exception:
+        logger.exception('Could not refresh the LBLOD dataset')
+        return False
+    await track(index, search=search)
+    return True
+
+
+def status():
+    """
+    Get the state of the dataset.
+
+    Returns:
+    A dictionary with the "version" digest of the dataset and the "refreshed" timestamp of the last time it was
+    fetched, both None if it hasn't been fetched yet, and the "source" of the lookups: "index" when they are answered
+    from an in-memory index or snapshot and "sparql" otherwise.
+    """
+    return {
+        'version': version,
+        'refreshed': refreshed,
+        'source': 'sparql' if helper_sparql.index is None else 'index'
+    }
+
+
+# Monotonic time before which the dataset isn't fetched again for the search index, after a failed fetch
+_search_retry = 0.0
+
+
+@helper_cache.cached('search')
+async def _refresh_search():
+    """
+    Fetch the dataset without installing it, only to fill the search index, and get the new dataset version.
+
+    SparqlUnavailable is raised when the dataset can't be fetched. The dataset is then not fetched again for
+    SPARQL_BREAKER_COOLDOWN seconds, so searches fail fast instead of every one of them downloading the dataset.
+    """
+    global _search_retry
+    retry_after = _search_retry - time.monotonic()
+    if retry_after > 0:
+        raise helper_sparql.SparqlUnavailable('The search index could not be loaded', retry_after)
+    if not await refresh(search=True):
+        _search_retry = time.monotonic() + helper_sparql.breaker.cooldown
+        raise helper_sparql.SparqlUnavailable('The search index could not be loaded', helper_sparql.breaker.cooldown)
+    return version
+
+
+# Task that builds the search index from the installed index on the first search
+_search_builder = None
+
+
+async def _build_search():
+    """Build the search index from the installed index in a worker thread."""
+    index = helper_sparql.index
+    search = await asyncio.get_event_loop().run_in_executor(None, helper_search.build, index)
+    # A version that was installed in the meantime is searched instead, it's built on the next search
+    if helper_search.index is None and helper_sparql.index is index:
+        helper_search.index = search
+        logger.info(f'Built the search index: {len(search)} documents')
+
+
+async def search_index():
+    """
+    Get the search index, building it on the first search.
+
+    It is built from the installed index or snapshot. Without one, the dataset is only fetched from the SPARQL database
+    when SEARCH_FROM_SPARQL is set, which then happens as often as the "search" namespace of the cache expires, unless
+    the dataset is refreshed periodically.
+
+    Returns:
+    The helper_search.SearchIndex. SparqlUnavailable is raised when the dataset can't be fetched and
+    helper_search.SearchUnavailable when there is no dataset to search.
+    """
+    global _search_builder
+    if helper_sparql.index is None:
+        if not environ.get('SEARCH_FROM_SPARQL'):
+            raise helper_search.SearchUnavailable('No index or snapshot is loaded')
+        if helper_search.index is None or _reloader is None:
+            await _refresh_search()
+    while helper_search.index is None and helper_sparql.index is not None:
+        if _search_builder is None or _search_builder.done():
+            _search_builder = asyncio.ensure_future(_build_search())
+        # A search that is cancelled doesn't abort the build for the other searches
+        await asyncio.shield(_search_builder)
+    if helper_search.index is None:
+        raise helper_search.SearchUnavailable('The search index is not built')
+    return helper_search.index
+
+
+async def reload_periodically(interval, reload=load):
+    """
+    Reload the index forever.
+
+    Keyword arguments:
+    interval -- number of seconds between two reloads.
+    reload -- coroutine function that reloads, load by default or refresh to only invalidate the cache.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await reload()
+
+
+_reloader = None
+
+
+def start_reloading(interval, reload=load):
+    """
+    Start reloading the index in the background.
+
+    Keyword arguments:
+    interval -- number of seconds between two reloads.
+    reload -- coroutine function that reloads, load by default or refresh to only invalidate the cache.
+    """
+    global _reloader
+    _reloader = asyncio.ensure_future(reload_periodically(interval, reload))
+
+
+def stop_reloading():
+    """Stop reloading the index, and tracking the version of an index that was installed, in the background."""
+    global _reloader, _tracker
+    if _reloader is not None:
+        _reloader.cancel()
+        _reloader = None
+    if _tracker is not None:
+        _tracker.cancel()
+        _tracker = None
@@ -0,0 +1,184 @@
+"""
+Fast JSON encoding and decoding, and response bodies that are serialized and compressed once.
+
+orjson is used when it is installed, unless JSON_LIBRARY is set to "json". Brotli variants of the response bodies are
+only available when the brotli package is installed.
+"""
+import gzip
+import json
+from os import environ
+
+from sanic import response
+
+import helper_http
+import helper_metrics
+from helper_cache import TTLCache, ttl_for
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+if orjson is not None and environ.get('JSON_LIBRARY', 'orjson') == 'orjson':
+
+    def dumps(obj):
+        """Serialize an object to UTF-8 encoded JSON bytes."""
+        return orjson.dumps(obj)
+
+    loads = orjson.loads
+else:
+
+    def dumps(obj):
+        """Serialize an object to UTF-8 encoded JSON bytes."""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    loads = json.loads
+
+# Bodies smaller than this number of bytes are not compressed, since the headers would outweigh the savings
+COMPRESS_MIN_SIZE = int(environ.get('COMPRESS_MIN_SIZE', 1024))
+# Higher levels give smaller bodies but take longer, which blocks the worker unless the body is cached
+GZIP_LEVEL = int(environ.get('COMPRESS_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+
+def accepted_encodings(req):
+    """
+    Get the content codings that the client accepts.
+
+    Keyword arguments:
+    req -- the Sanic request.
+
+    Returns:
+    A set with the lowercase names of the codings in the Accept-Encoding header that don't have a zero quality.
+    """
+    encodings = set()
+    for coding in req.headers.get('accept-encoding', '').split(','):
+        name, _, params = coding.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def negotiate(req):
+    """
+    Choose the content coding of a response body.
+
+    Keyword arguments:
+    req -- the Sanic request.
+
+    Returns:
+    "br" or "gzip", whichever the client accepts, preferring brotli when it is installed, or None.
+    """
+    encodings = accepted_encodings(req)
+    return 'br' if brotli is not None and 'br' in encodings else 'gzip' if 'gzip' in encodings else None
+
+
+def compress(body, encoding):
+    """
+    Compress a body with a content coding.
+
+    Keyword arguments:
+    body -- the bytes to compress.
+    encoding -- "br" or "gzip".
+
+    Returns:
+    The compressed bytes.
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class EncodedBody:
+    """
+    A JSON response body that is serialized once, with lazily compressed gzip and brotli variants.
+
+    The variants are computed on the first request that accepts them and are reused afterwards.
+    """
+
+    def __init__(self, obj):
+        with helper_metrics.JSON_DURATION.time():
+            self.raw = dumps(obj)
+        self._variants = {}
+        self._etag = None
+
+    @property
+    def etag(self):
+        """The strong entity tag of the uncompressed body."""
+        if self._etag is None:
+            self._etag = helper_http.etag(self.raw)
+        return self._etag
+
+    def variant(self, encoding):
+        """
+        Get the body compressed with a content coding.
+
+        Keyword arguments:
+        encoding -- "br" or "gzip".
+
+        Returns:
+        The compressed bytes.
+        """
+        body = self._variants.get(encoding)
+        if body is None:
+            body = self._variants[encoding] = compress(self.raw, encoding)
+        return body
+
+    def response(self, req, status=200, headers=None, namespace=None, etag=None):
+        """
+        Build the response for a request, in the best compressed variant the client accepts.
+
+        Keyword arguments:
+        req -- the Sanic request.
+        status -- HTTP status of the response.
+        headers -- optional dictionary of extra response headers.
+        namespace -- optional name of the endpoint in the Cache-Control configuration.
+            When it is given, the response has an ETag and Cache-Control header and is answered with 304
+            if the If-None-Match header of the request matches.
+        etag -- optional entity tag that overrides the hash of the body, like a tag of the dataset version.
+
+        Returns:
+        A Sanic response with the pre-serialized body.
+        """
+        headers = dict(headers or {}, Vary='Accept-Encoding')
+        body = self.raw
+        encoding = negotiate(req) if len(body) >= COMPRESS_MIN_SIZE else None
+        if namespace is not None:
+            tag = etag or self.etag
+            headers = helper_http.caching_headers(namespace, helper_http.variant_etag(tag, encoding), headers)
+            if status == 200 and helper_http.matches(req, tag):
+                return response.empty(status=304, headers=headers)
+        if encoding is not None:
+            body = self.variant(encoding)
+            headers['Content-Encoding'] = encoding
+        return response.raw(body, status=status, headers=headers, content_type='application/json')
+
+
+# Encoded bodies of cacheable responses, together with the result they were built from
+_bodies = TTLCache(int(environ.get('CACHE_SIZE', 1024)))
+
+
+def encoded_body(key, result, build):
+    """
+    Get the encoded response body that is built from a result, reusing it as long as the result doesn't change.
+
+    Keyword arguments:
+    key -- tuple that identifies the response, the first element is the namespace of the result in the cache.
+    result -- the result the body is built from, typically shared with the SPARQL cache.
+        The body is rebuilt as soon as a different result object is passed for the same key.
+    build -- function that builds the JSON object of the body from the result.
+
+    Returns:
+    An EncodedBody.
+    """
+    entry = _bodies.get(key)
+    if entry is not None and entry[0] is result:
+        return entry[1]
+    body = EncodedBody(build(result))
+    _bodies.set(key, (result, body), ttl_for(key[0]))
+    return body
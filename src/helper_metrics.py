@@ -0,0 +1,166 @@
+"""
+Metrics of the API in the Prometheus text exposition format.
+
+The metrics are kept per worker process, so every worker reports its own values.
+"""
+import time
+from contextlib import contextmanager
+
+import helper_cache
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# All metrics in the order in which they are rendered
+_registry = []
+
+
+def _labels(names, values):
+    """Format label names and values as a Prometheus label set."""
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+class Counter:
+    """A value that only goes up, per combination of label values."""
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        """Increase the value for the given label values."""
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        """Get the lines of the exposition format for this metric."""
+        for labels, value in self._values.items():
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+
+class Gauge(Counter):
+    """A value that can go up and down, per combination of label values."""
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        """Decrease the value for the given label values."""
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        """Set the value for the given label values."""
+        self._values[labels] = value
+
+
+class Histogram:
+    """Counts observations in cumulative buckets, per combination of label values."""
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self.buckets = buckets
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        """Record an observation for the given label values."""
+        values = self._values.get(labels)
+        if values is None:
+            values = self._values[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                values[i] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """Context manager that observes the number of seconds its body takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        """Get the lines of the exposition format for this metric."""
+        names = self.label_names + ('le', )
+        for labels, values in self._values.items():
+            for bound, count in zip(self.buckets, values):
+                yield f'{self.name}_bucket{_labels(names, labels + (bound, ))} {count}'
+            yield f'{self.name}_bucket{_labels(names, labels + ("+Inf", ))} {values[-1]}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {values[-2]}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {values[-1]}'
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time spent handling a request.',
+                             ('route', 'method', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'Number of requests that are being handled.')
+SPARQL_DURATION = Histogram('sparql_query_duration_seconds', 'Round trip time of a SPARQL query.', ('query', ))
+SPARQL_ERRORS = Counter('sparql_errors_total', 'Number of SPARQL queries that failed.', ('query', ))
+SPARQL_SHORT_CIRCUITED = Counter('sparql_short_circuited_total', 'Number of SPARQL queries that were not sent because '
+                                 'the circuit breaker was open.', ('query', ))
+SPARQL_CIRCUIT_OPEN = Gauge('sparql_circuit_open', 'Whether the circuit breaker of the SPARQL endpoint is open.')
+DB_DURATION = Histogram('db_query_duration_seconds', 'Time spent on a Postgres operation, including waiting for a '
+                        'pooled connection.', ('operation', ))
+DB_ERRORS = Counter('db_errors_total', 'Number of Postgres operations that failed unexpectedly.', ('operation', ))
+JSON_DURATION = Histogram('json_serialization_duration_seconds', 'Time spent serializing a JSON response.')
+LBLOD_ID_CHECKS = Counter('lblod_id_checks_total', 'Number of lblod IDs that were validated, by where the answer '
+                          'came from: the set of all persons, the cache of checked IDs or the SPARQL endpoint.',
+                          ('source', ))
+STORE_QUEUE_LENGTH = Gauge('store_queue_length', 'Number of registrations in the write-behind queue that are not '
+                           'stored yet.')
+DATASET_REFRESHED = Gauge('lblod_dataset_refreshed_timestamp_seconds', 'Time at which the LBLOD dataset was last '
+                          'fetched and compared with the previous version.')
+DATASET_CHANGES = Counter('lblod_dataset_changes_total', 'Number of lookups of which the result changed in a new '
+                          'version of the LBLOD dataset.', ('namespace', ))
+
+
+def render(index=None):
+    """
+    Render all metrics in the Prometheus text exposition format.
+
+    Keyword arguments:
+    index -- the in-memory LBLOD index that is in use, if any.
+
+    Returns:
+    A string with the current value of every metric, including the counters of the SPARQL cache and the index.
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+
+    stats = helper_cache.cache.stats()
+    lines.append('# HELP cache_hits_total Number of SPARQL results that were served from the cache.')
+    lines.append('# TYPE cache_hits_total counter')
+    lines.extend(f'cache_hits_total{_labels(("namespace", ), (namespace, ))} {count}'
+                 for namespace, count in stats['hits'].items())
+    lines.append('# HELP cache_misses_total Number of SPARQL results that were not in the cache.')
+    lines.append('# TYPE cache_misses_total counter')
+    lines.extend(f'cache_misses_total{_labels(("namespace", ), (namespace, ))} {count}'
+                 for namespace, count in stats['misses'].items())
+    lines.append('# HELP cache_stale_hits_total Number of expired SPARQL results that were served while refreshing them.')
+    lines.append('# TYPE cache_stale_hits_total counter')
+    lines.extend(f'cache_stale_hits_total{_labels(("namespace", ), (namespace, ))} {count}'
+                 for namespace, count in stats['stale_hits'].items())
+    lines.append('# HELP cache_coalesced_total Number of SPARQL results that were not in the cache but were already being '
+                 'computed for another request.')
+    lines.append('# TYPE cache_coalesced_total counter')
+    lines.extend(f'cache_coalesced_total{_labels(("namespace", ), (namespace, ))} {count}'
+                 for namespace, count in stats['coalesced'].items())
+    lines.append('# HELP cache_entries Number of SPARQL results in the cache.')
+    lines.append('# TYPE cache_entries gauge')
+    lines.append(f'cache_entries {stats["size"]}')
+
+    lines.append('# HELP lblod_index_loaded_timestamp_seconds Time at which the in-memory index was loaded, 0 if none.')
+    lines.append('# TYPE lblod_index_loaded_timestamp_seconds gauge')
+    lines.append(f'lblod_index_loaded_timestamp_seconds {index.created if index is not None else 0}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,193 @@
+"""
+Membership cache for the validation of lblod IDs, so /store/ doesn't send a SPARQL ASK for every registration.
+
+With LBLOD_PERSONS, the URIs of all persons are loaded with one bulk query and reloaded periodically, so checking a
+known person is a set lookup. IDs that are not in the set are checked with the SPARQL endpoint; an ID that doesn't
+exist is remembered for LBLOD_ID_NEGATIVE_TTL seconds, so clients that retry an invalid ID in a loop don't reach
+the endpoint, while a person that is added to the dataset is accepted soon after.
+"""
+import asyncio
+import time
+from os import environ
+
+from sanic.log import logger
+
+import helper_metrics
+import helper_queries
+import helper_sparql
+from helper_cache import TTLCache, ttl_for
+
+PERSONS_QUERY = helper_queries.ALL_PERSONS.render()
+
+
+class Membership:
+    """The set of all person URIs, with a cache of the IDs that were checked with the SPARQL endpoint."""
+
+    def __init__(self, size, negative_ttl, positive_ttl):
+        """
+        Keyword arguments:
+        size -- maximum number of checked IDs that are cached.
+        negative_ttl -- number of seconds an ID that doesn't exist is cached.
+        positive_ttl -- number of seconds an ID that exists but isn't in the set is cached.
+        """
+        self.persons = frozenset()
+        self.loaded = None
+        self.negative_ttl = negative_ttl
+        self.positive_ttl = positive_ttl
+        self._checks = TTLCache(size)
+
+    def replace(self, persons):
+        """
+        Replace the set of persons.
+
+        Keyword arguments:
+        persons -- iterable of the URIs of all persons.
+        """
+        self.persons = frozenset(persons)
+        self.loaded = time.time()
+        # Cached answers may contradict the new set, the IDs that are not in it are checked again
+        self._checks.invalidate()
+
+    async def _check(self, lblod_id):
+        """Check an ID with the SPARQL endpoint."""
+        helper_metrics.LBLOD_ID_CHECKS.inc('sparql')
+        return await helper_sparql.lblod_id_exists(lblod_id)
+
+    async def exists(self, lblod_id):
+        """
+        Check if an lblod ID exists, like helper_sparql.lblod_id_exists.
+
+        Concurrent checks of the same ID that is not cached send a single query.
+
+        Keyword arguments:
+        lblod_id -- string that represents the lblod ID of which the existence will be checked.
+
+        Returns:
+        Boolean reflecting whether or not the lblod ID exists.
+        """
+        if lblod_id in self.persons:
+            helper_metrics.LBLOD_ID_CHECKS.inc('set')
+            return True
+        key = ('lblod_id_exists', lblod_id)
+        cached = self._checks.get(key)
+        if cached is not None:
+            helper_metrics.LBLOD_ID_CHECKS.inc('cache')
+            return cached
+        exists = await self._checks.get_or_compute(key, self.negative_ttl, lambda: self._check(lblod_id))
+        if exists:
+            # Known persons are cached longer than unknown IDs, which might be added to the dataset at any time
+            self._checks.set(key, True, self.positive_ttl)
+        return exists
+
+    async def existing(self, lblod_ids):
+        """
+        Check which lblod IDs of a batch exist, like helper_sparql.lblod_ids_exist.
+
+        Only the IDs that are neither in the set nor cached are checked with the SPARQL endpoint, in one batch.
+
+        Keyword arguments:
+        lblod_ids -- iterable of strings that represent the lblod IDs of which the existence will be checked.
+
+        Returns:
+        A set with the lblod IDs that exist.
+        """
+        result = set()
+        unknown = []
+        for lblod_id in set(lblod_ids):
+            if lblod_id in self.persons:
+                helper_metrics.LBLOD_ID_CHECKS.inc('set')
+                result.add(lblod_id)
+                continue
+            cached = self._checks.get(('lblod_id_exists', lblod_id))
+            if cached is None:
+                unknown.append(lblod_id)
+            else:
+                helper_metrics.LBLOD_ID_CHECKS.inc('cache')
+                if cached:
+                    result.add(lblod_id)
+        if unknown:
+            helper_metrics.LBLOD_ID_CHECKS.inc('sparql', amount=len(unknown))
+            existing = await helper_sparql.lblod_ids_exist(unknown)
+            for lblod_id in unknown:
+                exists = lblod_id in existing
+                self._checks.set(('lblod_id_exists', lblod_id), exists,
+                                 self.positive_ttl if exists else self.negative_ttl)
+            result.update(existing)
+        return result
+
+
+membership = Membership(int(environ.get('LBLOD_ID_CACHE_SIZE', 10000)),
+                        negative_ttl=float(environ.get('LBLOD_ID_NEGATIVE_TTL', 60)),
+                        positive_ttl=ttl_for('lblod_id_exists'))
+
+
+def enabled():
+    """Check if loading all persons is enabled with the LBLOD_PERSONS environment variable."""
+    return bool(environ.get('LBLOD_PERSONS'))
+
+
+async def lblod_id_exists(lblod_id):
+    """Check if an lblod ID exists, from the in-memory index if one is loaded or from the membership cache."""
+    if helper_sparql.index is not None:
+        return await helper_sparql.lblod_id_exists(lblod_id)
+    return await membership.exists(lblod_id)
+
+
+async def lblod_ids_exist(lblod_ids):
+    """Check which lblod IDs of a batch exist, from the in-memory index or the membership cache."""
+    if helper_sparql.index is not None:
+        return await helper_sparql.lblod_ids_exist(lblod_ids)
+    return await membership.existing(lblod_ids)
+
+
+async def load():
+    """
+    Load the URIs of all persons into the membership cache.
+
+    Returns:
+    Boolean reflecting whether the persons were loaded. The previous set is kept when loading fails.
+    """
+    try:
+        rows = await helper_sparql.make_paged_query(PERSONS_QUERY,
+                                                    timeout=float(environ.get('LBLOD_INDEX_TIMEOUT', 120)),
+                                                    name=helper_queries.ALL_PERSONS.name)
+    except Exception:
+        logger.exception('Could not load the persons of the LBLOD dataset')
+        return False
+    membership.replace(row['personURI']['value'] for row in rows)
+    logger.info(f'Loaded {len(membership.persons)} persons of the LBLOD dataset')
+    return True
+
+
+async def reload_periodically(interval):
+    """
+    Reload the persons forever.
+
+    Keyword arguments:
+    interval -- number of seconds between two reloads.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await load()
+
+
+_reloader = None
+
+
+def start_reloading(interval):
+    """
+    Start reloading the persons in the background.
+
+    Keyword arguments:
+    interval -- number of seconds between two reloads.
+    """
+    global _reloader
+    _reloader = asyncio.ensure_future(reload_periodically(interval))
+
+
+def stop_reloading():
+    """Stop reloading the persons in the background."""
+    global _reloader
+    if _reloader is not None:
+        _reloader.cancel()
+        _reloader = None
@@ -0,0 +1,247 @@
+"""
+Registry of all the SPARQL queries of the API.
+
+Every query is defined once as a template with $-placeholders for its IRI parameters and compiled when this module is
+loaded: the whitespace is collapsed and the declarations of the prefixes it uses are prepended. Rendering a query only
+validates the IRIs and substitutes them, so user input can never change the structure of a query.
+"""
+import re
+from string import Template
+
+# Prefixes that can be used by all queries, a query only declares the ones it uses
+PREFIXES = {
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'rdfs': 'http://www.w3.org/2000/01/rdf-schema#',
+    'skos': 'http://www.w3.org/2004/02/skos/core#',
+    'foaf': 'http://xmlns.com/foaf/0.1/',
+    'person': 'http://www.w3.org/ns/person#',
+    'mandaat': 'http://data.vlaanderen.be/ns/mandaat#',
+    'besluit': 'http://data.vlaanderen.be/ns/besluit#',
+    'persoon': 'http://data.vlaanderen.be/ns/persoon#'
+}
+
+# Characters that can't occur in an IRI reference, see the IRIREF production of the SPARQL grammar
+INVALID_IRI = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+
+PREFIXED_NAME = re.compile(r'\b([a-z]+):')
+
+
+class InvalidIRI(ValueError):
+    """Raised when a query parameter is not a valid IRI."""
+
+
+def iri(value):
+    """
+    Escape a query parameter as an IRI reference.
+
+    Keyword arguments:
+    value -- string that should be an IRI.
+
+    Returns:
+    The IRI between angle brackets. InvalidIRI is raised when the value is empty or contains characters that are not
+    allowed in an IRI, since those could end the IRI and inject SPARQL.
+    """
+    if not isinstance(value, str) or not value or INVALID_IRI.search(value):
+        raise InvalidIRI(f'Not a valid IRI: {value!r}')
+    return f'<{value}>'
+
+
+class Query:
+    """A compiled SPARQL query template."""
+
+    def __init__(self, name, template):
+        """
+        Keyword arguments:
+        name -- name of the query in the metrics and the timeout configuration.
+        template -- SPARQL query without PREFIX declarations. $name placeholders are replaced by IRIs when rendering.
+        """
+        self.name = name
+        body = ' '.join(template.split())
+        prefixes = ''.join(f'PREFIX {prefix}: <{PREFIXES[prefix]}>\n'
+                           for prefix in dict.fromkeys(PREFIXED_NAME.findall(body)) if prefix in PREFIXES)
+        self.template = Template(prefixes + body)
+        self.parameters = {named or braced
+                           for _, named, braced, _ in self.template.pattern.findall(self.template.template)
+                           if named or braced}
+        self.text = None if self.parameters else self.template.template
+
+    def render(self, **arguments):
+        """
+        Render the query with the given parameters.
+
+        Keyword arguments:
+        arguments -- an IRI string for every parameter, or an iterable of IRI strings for a parameter that is used
+            in a VALUES clause.
+
+        Returns:
+        The query string. InvalidIRI is raised when one of the arguments is not a valid IRI.
+        """
+        if self.text is not None:
+            return self.text
+        return self.template.substitute({
+            name: iri(value) if isinstance(value, str) else ' '.join(iri(item) for item in value)
+            for name, value in arguments.items()
+        })
+
+
+LBLOD_ID_EXISTS = Query('lblod_id_exists', """
+    ASK {
+        $person rdf:type person:Person.
+    }""")
+
+LBLOD_IDS_EXIST = Query('lblod_ids_exist', """
+    SELECT DISTINCT ?person
+    WHERE {
+        VALUES ?person { $persons }
+        ?person rdf:type person:Person.
+    }""")
+
+CITIES = Query('cities', """
+    SELECT DISTINCT ?cityURI ?cityName ?locationLabel
+    WHERE {
+        ?list rdf:type mandaat:Kandidatenlijst;
+        mandaat:behoortTot ?election.
+        ?election mandaat:steltSamen ?bestuursOrgaan.
+        ?bestuursOrgaan mandaat:isTijdspecialisatieVan ?bestuursOrgaan2.
+        ?bestuursOrgaan2 besluit:bestuurt ?bestuursEenheid.
+        ?bestuursEenheid besluit:werkingsgebied ?cityURI;
+        besluit:classificatie ?classificationCode.
+        ?classificationCode skos:prefLabel ?locationLabel.
+        ?cityURI rdfs:label ?cityName.
+        FILTER NOT EXISTS {
+            ?classificationCode skos:prefLabel "OCMW"
+        }
+    }""")
+
+LISTS = Query('lists', """
+    SELECT DISTINCT ?listURI ?listName
+    WHERE {
+        ?listURI rdf:type mandaat:Kandidatenlijst;
+        skos:prefLabel ?listName;
+        mandaat:behoortTot ?election.
+        ?election mandaat:steltSamen ?bestuursOrgaan.
+        ?bestuursOrgaan mandaat:isTijdspecialisatieVan ?bestuursOrgaan2.
+        ?bestuursOrgaan2 besluit:bestuurt ?bestuursEenheid.
+        ?bestuursEenheid besluit:werkingsgebied $city;
+        besluit:classificatie ?classificationCode.
+        ?classificationCode skos:prefLabel ?locationLabel.
+        FILTER NOT EXISTS {
+            ?classificationCode skos:prefLabel "OCMW"
+        }
+    }""")
+
+CANDIDATES = Query('candidates', """
+    SELECT DISTINCT ?personURI ?name ?familyName
+    WHERE {
+        $list mandaat:heeftKandidaat ?personURI.
+        ?personURI persoon:gebruikteVoornaam ?name;
+        foaf:familyName ?familyName.
+    }""")
+
+CITY_OVERVIEW = Query('city_overview', """
+    SELECT DISTINCT ?listURI ?listName ?trackingNb ?personURI ?name ?familyName
+    WHERE {
+        ?listURI rdf:type mandaat:Kandidatenlijst;
+        skos:prefLabel ?listName;
+        mandaat:behoortTot ?election.
+        ?election mandaat:steltSamen ?bestuursOrgaan.
+        ?bestuursOrgaan mandaat:isTijdspecialisatieVan ?bestuursOrgaan2.
+        ?bestuursOrgaan2 besluit:bestuurt ?bestuursEenheid.
+        ?bestuursEenheid besluit:werkingsgebied $city;
+        besluit:classificatie ?classificationCode.
+        FILTER NOT EXISTS {
+            ?classificationCode skos:prefLabel "OCMW"
+        }
+        OPTIONAL {
+            ?listURI mandaat:lijstnummer ?trackingNb.
+        }
+        OPTIONAL {
+            ?listURI mandaat:heeftKandidaat ?personURI.
+            ?personURI persoon:gebruikteVoornaam ?name;
+            foaf:familyName ?familyName.
+        }
+    }
+    ORDER BY ?listURI ?personURI""")
+
+PERSON = Query('person', """
+    SELECT DISTINCT ?name ?familyName ?listURI ?listName ?trackingNb
+    WHERE {
+        $person persoon:gebruikteVoornaam ?name;
+        foaf:familyName ?familyName.
+        ?listURI mandaat:heeftKandidaat $person;
+        skos:prefLabel ?listName;
+        mandaat:lijstnummer ?trackingNb.
+    }""")
+
+PERSONS = Query('persons', """
+    SELECT DISTINCT ?personURI ?name ?familyName ?listURI ?listName ?trackingNb
+    WHERE {
+        VALUES ?personURI { $persons }
+        ?personURI persoon:gebruikteVoornaam ?name;
+        foaf:familyName ?familyName.
+        ?listURI mandaat:heeftKandidaat ?personURI;
+        skos:prefLabel ?listName;
+        mandaat:lijstnummer ?trackingNb.
+    }""")
+
+# Bulk queries that load the whole candidate-list graph for the in-memory index and the snapshots.
+# They are ordered so they can be fetched in pages.
+
+ALL_CITIES = Query('index_cities', """
+    SELECT DISTINCT ?cityURI ?cityName ?locationLabel
+    WHERE {
+        ?list rdf:type mandaat:Kandidatenlijst;
+        mandaat:behoortTot ?election.
+        ?election mandaat:steltSamen ?bestuursOrgaan.
+        ?bestuursOrgaan mandaat:isTijdspecialisatieVan ?bestuursOrgaan2.
+        ?bestuursOrgaan2 besluit:bestuurt ?bestuursEenheid.
+        ?bestuursEenheid besluit:werkingsgebied ?cityURI;
+        besluit:classificatie ?classificationCode.
+        ?classificationCode skos:prefLabel ?locationLabel.
+        ?cityURI rdfs:label ?cityName.
+        FILTER NOT EXISTS {
+            ?classificationCode skos:prefLabel "OCMW"
+        }
+    }
+    ORDER BY ?cityURI ?cityName ?locationLabel""")
+
+ALL_LISTS = Query('index_lists', """
+    SELECT DISTINCT ?cityURI ?listURI ?listName
+    WHERE {
+        ?listURI rdf:type mandaat:Kandidatenlijst;
+        skos:prefLabel ?listName;
+        mandaat:behoortTot ?election.
+        ?election mandaat:steltSamen ?bestuursOrgaan.
+        ?bestuursOrgaan mandaat:isTijdspecialisatieVan ?bestuursOrgaan2.
+        ?bestuursOrgaan2 besluit:bestuurt ?bestuursEenheid.
+        ?bestuursEenheid besluit:werkingsgebied ?cityURI;
+        besluit:classificatie ?classificationCode.
+        FILTER NOT EXISTS {
+            ?classificationCode skos:prefLabel "OCMW"
+        }
+    }
+    ORDER BY ?cityURI ?listURI ?listName""")
+
+ALL_CANDIDATES = Query('index_candidates', """
+    SELECT DISTINCT ?listURI ?personURI ?name ?familyName
+    WHERE {
+        ?listURI mandaat:heeftKandidaat ?personURI.
+        ?personURI persoon:gebruikteVoornaam ?name;
+        foaf:familyName ?familyName.
+    }
+    ORDER BY ?listURI ?personURI ?name ?familyName""")
+
+ALL_LIST_NUMBERS = Query('index_list_numbers', """
+    SELECT DISTINCT ?listURI ?listName ?trackingNb
+    WHERE {
+        ?listURI mandaat:lijstnummer ?trackingNb;
+        skos:prefLabel ?listName.
+    }
+    ORDER BY ?listURI ?listName ?trackingNb""")
+
+ALL_PERSONS = Query('index_persons', """
+    SELECT DISTINCT ?personURI
+    WHERE {
+        ?personURI rdf:type person:Person.
+    }
+    ORDER BY ?personURI""")
@@ -0,0 +1,267 @@
+"""
+In-memory search index over the names of the cities, lists and candidates, for prefix and fuzzy matching.
+
+The index is built from the in-memory LBLOD index or snapshot (see helper_index) on the first search. A document only
+keeps the interned strings of its result row, the row itself is built for the results of a search. When a new version
+of the dataset is tracked, a copy of the search index is updated in a worker thread, touching only the documents that
+were added, removed or renamed, and swapped in.
+"""
+import re
+import sys
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+
+# Words with at least this share of trigrams in common with a word of the query match it when fuzzy matching
+FUZZY_THRESHOLD = 0.4
+
+NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+
+# Variables of the result row of every kind of document, in the order of the values of the document
+FIELDS = {
+    'city': ('cityURI', 'cityName', 'locationLabel'),
+    'list': ('listURI', 'listName', 'cityURI', 'cityName'),
+    'candidate': ('personURI', 'name', 'familyName', 'listURI', 'listName', 'cityURI', 'cityName')
+}
+
+
+class SearchUnavailable(Exception):
+    """Raised when no index or snapshot is loaded to search and SEARCH_FROM_SPARQL is not set."""
+
+
+def normalize(text):
+    """
+    Normalize a text for matching.
+
+    Returns:
+    The lowercase words of the text without accents, e.g. ["sint", "niklaas"] for "Sint-Niklaas".
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NON_ALPHANUMERIC.sub(' ', text).split()
+
+
+def trigrams(word):
+    """Get the set of trigrams of a word, padded so the start and end of the word have trigrams of their own."""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def text(values):
+    """Get the searchable text of a document: the name of a city or list, or the full name of a candidate."""
+    if values[0] == 'candidate':
+        return f'{values[2]} {values[3]}'
+    return values[2]
+
+
+def row(values):
+    """
+    Build the result row of a document.
+
+    Returns:
+    The SPARQL bindings of the document and a "kind" binding with the value "city", "list" or "candidate".
+    """
+    result = {
+        variable: {
+            'type': 'uri' if variable.endswith('URI') else 'literal',
+            'value': value
+        } for variable, value in zip(FIELDS[values[0]], values[1:])
+    }
+    result['kind'] = {'type': 'literal', 'value': values[0]}
+    return result
+
+
+def documents(index):
+    """
+    Get the searchable documents of an LBLOD index.
+
+    Keyword arguments:
+    index -- an ElectionIndex or SnapshotIndex.
+
+    Returns:
+    A dictionary that maps the key of every document to a tuple of its kind ("city", "list" or "candidate") and the
+        values of its result row in the order of FIELDS. All strings are interned, so the names and URIs that
+        documents have in common, like the city of a list and of its candidates, are stored once.
+    """
+    docs = {}
+    for city in index.cities():
+        city_uri, city_name, location = (sys.intern(city[field]['value']) for field in FIELDS['city'])
+        docs[('city', city_uri)] = ('city', city_uri, city_name, location)
+        for list_row in index.lists(city_uri):
+            list_uri = sys.intern(list_row['listURI']['value'])
+            list_name = sys.intern(list_row['listName']['value'])
+            docs[('list', list_uri, city_uri)] = ('list', list_uri, list_name, city_uri, city_name)
+            for candidate in index.candidates(list_uri):
+                person_uri = sys.intern(candidate['personURI']['value'])
+                docs[('candidate', person_uri, list_uri)] = ('candidate', person_uri,
+                                                             sys.intern(candidate['name']['value']),
+                                                             sys.intern(candidate['familyName']['value']), list_uri,
+                                                             list_name, city_uri, city_name)
+    return docs
+
+
+def build(index):
+    """
+    Build a search index with the documents of an LBLOD index, which takes seconds for a full election.
+
+    Keyword arguments:
+    index -- an ElectionIndex or SnapshotIndex.
+    """
+    search = SearchIndex()
+    search.update(documents(index))
+    return search
+
+
+class SearchIndex:
+    """
+    Inverted index from words to documents, with a sorted vocabulary for prefix matching and a trigram index of the
+    vocabulary for fuzzy matching.
+
+    An index that answers searches must not be modified, `update` is only called on a copy that isn't used yet, so
+    requests never see a partial update.
+    """
+
+    def __init__(self):
+        self.documents = {}  # key -> (kind, values of the result row...)
+        self.version = 0
+        self._postings = {}  # word -> set of document keys
+        self._vocabulary = []  # sorted list of the words in _postings
+        self._trigrams = {}  # trigram -> set of words
+        self._trigram_counts = {}  # word -> number of trigrams of the word
+
+    def __len__(self):
+        return len(self.documents)
+
+    def copy(self):
+        """Get a copy of the index that can be updated, sharing the documents but not the structures that change."""
+        other = SearchIndex()
+        other.documents = dict(self.documents)
+        other.version = self.version
+        other._postings = {word: set(keys) for word, keys in self._postings.items()}
+        other._vocabulary = self._vocabulary
+        other._trigrams = {trigram: set(words) for trigram, words in self._trigrams.items()}
+        other._trigram_counts = dict(self._trigram_counts)
+        return other
+
+    def _add(self, key, values):
+        self.documents[key] = values
+        for word in set(normalize(text(values))):
+            keys = self._postings.get(word)
+            if keys is None:
+                keys = self._postings[word] = set()
+                word_trigrams = trigrams(word)
+                self._trigram_counts[word] = len(word_trigrams)
+                for trigram in word_trigrams:
+                    self._trigrams.setdefault(trigram, set()).add(word)
+            keys.add(key)
+
+    def _remove(self, key):
+        for word in set(normalize(text(self.documents.pop(key)))):
+            keys = self._postings[word]
+            keys.discard(key)
+            if not keys:
+                del self._postings[word]
+                del self._trigram_counts[word]
+                for trigram in trigrams(word):
+                    self._trigrams[trigram].discard(word)
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+
+    def update(self, docs):
+        """
+        Make the index contain exactly the given documents, only touching the ones that changed.
+
+        Keyword arguments:
+        docs -- dictionary that maps the key of every document to its values, as returned by `documents`.
+
+        Returns:
+        A tuple of the number of added, removed and changed documents.
+        """
+        removed = [key for key in self.documents if key not in docs]
+        changed = [key for key, values in docs.items() if key in self.documents and self.documents[key] != values]
+        added = [key for key in docs if key not in self.documents]
+        for key in removed + changed:
+            self._remove(key)
+        for key in changed + added:
+            self._add(key, docs[key])
+        if removed or changed or added:
+            # Sorting once is faster than inserting every new word in order
+            self._vocabulary = sorted(self._postings)
+            self.version += 1
+        return len(added), len(removed), len(changed)
+
+    def _prefix_matches(self, word):
+        """Get the words of the vocabulary that start with a word."""
+        start = bisect_left(self._vocabulary, word)
+        end = bisect_left(self._vocabulary, word + '￿', start)
+        return self._vocabulary[start:end]
+
+    def _fuzzy_matches(self, word):
+        """Get the words of the vocabulary that are similar to a word, with their similarity between 0 and 1."""
+        query = trigrams(word)
+        # A word needs this many trigrams in common to reach the threshold, even if it has no other trigrams
+        minimum = FUZZY_THRESHOLD * len(query)
+        shared = Counter(chain.from_iterable(self._trigrams.get(trigram, ()) for trigram in query))
+        matches = {}
+        for candidate, count in shared.items():
+            if count >= minimum:
+                similarity = count / (len(query) + self._trigram_counts[candidate] - count)
+                if similarity >= FUZZY_THRESHOLD:
+                    matches[candidate] = similarity
+        return matches
+
+    def _scores(self, word, fuzzy):
+        """Score every document that matches a word of the query: 3 for a whole word, 2 for a prefix, less for fuzzy."""
+        scores = {}
+        if fuzzy:
+            for match, similarity in self._fuzzy_matches(word).items():
+                for key in self._postings[match]:
+                    scores[key] = max(scores.get(key, 0), similarity)
+        for match in self._prefix_matches(word):
+            score = 3 if match == word else 2
+            for key in self._postings[match]:
+                scores[key] = max(scores.get(key, 0), score)
+        return scores
+
+    def search(self, query, limit=20, kinds=None, fuzzy=True):
+        """
+        Search the documents that match every word of a query.
+
+        A word of the query matches a word of a document when it is a prefix of it, or, with fuzzy matching, when the
+        words are similar. Documents are ranked by how well their words match and then by the length of their text.
+
+        Keyword arguments:
+        query -- the text to search.
+        limit -- maximum number of results.
+        kinds -- optional collection of the kinds ("city", "list" or "candidate") to search, all when omitted.
+        fuzzy -- whether similar words match as well, when there are fewer than `limit` prefix matches.
+
+        Returns:
+        The result rows of the best matching documents.
+        """
+        words = normalize(query)
+        if not words:
+            return []
+        for use_fuzzy in (False, True) if fuzzy else (False, ):
+            total = None
+            for word in words:
+                scores = self._scores(word, use_fuzzy)
+                if total is None:
+                    total = scores
+                else:
+                    total = {key: score + scores[key] for key, score in total.items() if key in scores}
+                if not total:
+                    break
+            if kinds is not None:
+                total = {key: score for key, score in total.items() if key[0] in kinds}
+            if len(total) >= limit:
+                break
+        texts = {key: text(self.documents[key]) for key in total}
+        ranked = sorted(total, key=lambda key: (-total[key], len(texts[key]), texts[key]))
+        return [row(self.documents[key]) for key in ranked[:limit]]
+
+
+# Built by helper_index.search_index on the first search and replaced as a whole by helper_index.track whenever a new
+# version of the dataset is tracked, None until then
+index = None
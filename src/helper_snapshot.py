@@ -0,0 +1,338 @@
+"""
+Offline snapshot of the candidate-list graph, so the read endpoints can be served without the SPARQL database.
+
+A snapshot is a binary file with a table of all the strings and tables of rows that refer to those strings by their
+integer ID. It is memory-mapped when it is loaded, so all the workers on a host share one page-cached copy.
+
+Usage:
+    python helper_snapshot.py export <snapshot file> [--rdf <RDF dump> ...]
+    python helper_snapshot.py info <snapshot file>
+
+Layout (all integers are unsigned 32-bit little-endian):
+    header        -- magic, version, number of strings, size of the string data and number of rows of every table
+    offsets       -- number of strings + 1 offsets into the string data, string i is data[offsets[i]:offsets[i + 1]]
+    string data   -- all UTF-8 encoded strings in sorted order, padded to a multiple of 4 bytes
+    tables        -- the rows of every table in TABLES, as string IDs and sorted on the first column
+    person rows   -- the indexes of the rows in the candidates table, sorted on their person
+"""
+import argparse
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from os import environ
+
+from sanic.log import logger
+
+import helper_index
+import helper_sparql
+
+MAGIC = b'LBLODSNP'
+VERSION = 1
+
+# Name of every table with the variables of the query that fills it, in the order of helper_index.ElectionIndex
+TABLES = (
+    ('cities', helper_index.CITIES_QUERY, ('cityURI', 'cityName', 'locationLabel')),
+    ('lists', helper_index.LISTS_QUERY, ('cityURI', 'listURI', 'listName')),
+    ('candidates', helper_index.CANDIDATES_QUERY, ('listURI', 'personURI', 'name', 'familyName')),
+    ('list_numbers', helper_index.LIST_NUMBERS_QUERY, ('listURI', 'listName', 'trackingNb')),
+    ('persons', helper_index.PERSONS_QUERY, ('personURI', )),
+)
+
+HEADER = struct.Struct('<8sIII' + 'I' * len(TABLES))
+
+
+def binding_type(variable):
+    """Get the SPARQL binding type of a variable, the URIs are the only variables that are not literals."""
+    return 'uri' if variable.endswith('URI') else 'literal'
+
+
+def write(path, results):
+    """
+    Write a snapshot file, replacing an existing one atomically.
+
+    Keyword arguments:
+    path -- path of the file to write.
+    results -- list with the SPARQL bindings of every query in TABLES, in the same order.
+    """
+    strings = sorted({row[variable]['value'] for (_, _, variables), rows in zip(TABLES, results)
+                      for row in rows for variable in variables})
+    ids = {string: i for i, string in enumerate(strings)}
+
+    data = bytearray()
+    offsets = [0]
+    for string in strings:
+        data += string.encode('utf-8')
+        offsets.append(len(data))
+    data += b'\0' * (-len(data) % 4)
+
+    tables = []
+    for (_, _, variables), rows in zip(TABLES, results):
+        tables.append(sorted({tuple(ids[row[variable]['value']] for variable in variables) for row in rows}))
+    candidates = tables[2]
+    person_rows = sorted(range(len(candidates)), key=lambda i: candidates[i][1])
+
+    # Workers may have the snapshot at this path memory-mapped, and truncating it would crash them with SIGBUS. The new
+    # snapshot is written to a temporary file that replaces it once complete, so they keep the old one mapped.
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix=f'.{name}.', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(strings), len(data), *(len(table) for table in tables)))
+            file.write(_pack(offsets))
+            file.write(data)
+            for table in tables:
+                file.write(_pack(value for row in table for value in row))
+            file.write(_pack(person_rows))
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file readable by its owner only, while the workers may run as another user
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def _pack(values):
+    """Encode integers as unsigned 32-bit little-endian."""
+    values = array('I', values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+class SnapshotIndex:
+    """
+    Read-only index backed by a memory-mapped snapshot file.
+
+    It answers the same lookups as helper_index.ElectionIndex, by binary search in the mapped tables.
+    """
+
+    def __init__(self, path):
+        """
+        Map a snapshot file into memory.
+
+        Keyword arguments:
+        path -- path of the snapshot file.
+            Raises a ValueError when the file is not a snapshot of a supported version.
+        """
+        if sys.byteorder != 'little':
+            raise ValueError('Snapshots can only be mapped on little-endian machines')
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, string_count, data_size, *row_counts = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} LBLOD snapshot')
+        self.created = time.time()
+
+        view = memoryview(self._mmap)
+        position = HEADER.size
+        self._offsets = view[position:position + 4 * (string_count + 1)].cast('I')
+        position += 4 * (string_count + 1)
+        self._data_start = position
+        self._string_count = string_count
+        position += data_size
+
+        self._tables = {}
+        for (name, _, variables), row_count in zip(TABLES, row_counts):
+            size = 4 * row_count * len(variables)
+            self._tables[name] = (view[position:position + size].cast('I'), len(variables), variables)
+            position += size
+        self._person_rows = view[position:position + 4 * row_counts[2]].cast('I')
+
+    def _string(self, string_id):
+        """Get the string with a given ID."""
+        start = self._data_start + self._offsets[string_id]
+        end = self._data_start + self._offsets[string_id + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def _id(self, string):
+        """Get the ID of a string, or None if the string is not in the snapshot."""
+        key = string.encode('utf-8')
+        low, high = 0, self._string_count
+        while low < high:
+            middle = (low + high) // 2
+            start = self._data_start + self._offsets[middle]
+            if self._mmap[start:self._data_start + self._offsets[middle + 1]] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._string_count and self._string(low) == string:
+            return low
+        return None
+
+    def _rows(self, name, key_id=None):
+        """Get the rows of a table as tuples of string IDs, only the rows of which the first column is key_id if given."""
+        table, width, _ = self._tables[name]
+        count = len(table) // width
+        low, high = 0, count
+        if key_id is not None:
+            while low < high:
+                middle = (low + high) // 2
+                if table[middle * width] < key_id:
+                    low = middle + 1
+                else:
+                    high = middle
+        for row in range(low, count):
+            values = tuple(table[row * width:(row + 1) * width])
+            if key_id is not None and values[0] != key_id:
+                break
+            yield values
+
+    def _bindings(self, variables, values):
+        """Build a row of SPARQL bindings."""
+        return {
+            variable: {
+                'type': binding_type(variable),
+                'value': self._string(value)
+            } for variable, value in zip(variables, values) if variable is not None
+        }
+
+    def cities(self):
+        """Get all the cities, like helper_sparql.get_lblod_cities."""
+        return [self._bindings(('cityURI', 'cityName', 'locationLabel'), row) for row in self._rows('cities')]
+
+    def lists(self, city_uri):
+        """Get all the lists of a city, like helper_sparql.get_lblod_lists."""
+        city_id = self._id(city_uri)
+        if city_id is None:
+            return []
+        return [self._bindings((None, 'listURI', 'listName'), row) for row in self._rows('lists', city_id)]
+
+    def candidates(self, list_uri):
+        """Get all the candidates of a list, like helper_sparql.get_lblod_candidates."""
+        list_id = self._id(list_uri)
+        if list_id is None:
+            return []
+        return [self._bindings((None, 'personURI', 'name', 'familyName'), row) for row in self._rows('candidates', list_id)]
+
+    def list_numbers(self, list_uri):
+        """Get the names and tracking numbers of a list, as rows with "listName" and "trackingNb"."""
+        list_id = self._id(list_uri)
+        if list_id is None:
+            return []
+        return [self._bindings((None, 'listName', 'trackingNb'), row) for row in self._rows('list_numbers', list_id)]
+
+    def person_info(self, person_uri):
+        """Get the info of a person, like helper_sparql.get_lblod_person_info."""
+        person_id = self._id(person_uri)
+        if person_id is None:
+            return []
+        candidates, width, _ = self._tables['candidates']
+        low, high = 0, len(self._person_rows)
+        while low < high:
+            middle = (low + high) // 2
+            if candidates[self._person_rows[middle] * width + 1] < person_id:
+                low = middle + 1
+            else:
+                high = middle
+
+        result = []
+        for row in self._person_rows[low:]:
+            list_id, row_person_id, name, family_name = candidates[row * width:(row + 1) * width]
+            if row_person_id != person_id:
+                break
+            for _, list_name, tracking_nb in self._rows('list_numbers', list_id):
+                result.append(
+                    self._bindings(('name', 'familyName', 'listURI', 'listName', 'trackingNb'),
+                                   (name, family_name, list_id, list_name, tracking_nb)))
+        return result
+
+    def person_exists(self, person_uri):
+        """Check if a person exists, like helper_sparql.lblod_id_exists."""
+        person_id = self._id(person_uri)
+        return person_id is not None and next(self._rows('persons', person_id), None) is not None
+
+    def stats(self):
+        """
+        Get the size of the snapshot.
+
+        Returns:
+        A dictionary with the number of "strings" and the number of rows of every table.
+        """
+        stats = {'created': self.created, 'strings': self._string_count}
+        for name, (table, width, _) in self._tables.items():
+            stats[name] = len(table) // width
+        return stats
+
+
+def load(path):
+    """
+    Load a snapshot file and use it to answer lookups.
+
+    Keyword arguments:
+    path -- path of the snapshot file.
+
+    Returns:
+    Boolean reflecting whether the snapshot was loaded.
+    """
+    try:
+        index = SnapshotIndex(path)
+    except (OSError, ValueError):
+        logger.exception(f'Could not load the LBLOD snapshot {path}')
+        return False
+    # The snapshot is loaded before anything is cached, so it can answer lookups while its version is tracked
+    helper_index.install_now(index)
+    logger.info(f'Loaded the LBLOD snapshot {path}: {index.stats()}')
+    return True
+
+
+async def fetch_from_sparql():
+    """Fetch the bindings of every query in TABLES from the SPARQL database."""
+    timeout = float(environ.get('LBLOD_INDEX_TIMEOUT', 120))
+    await helper_sparql.open_session()
+    try:
+        return [await helper_sparql.make_paged_query(query, timeout=timeout) for _, query, _ in TABLES]
+    finally:
+        await helper_sparql.close_session()
+
+
+def fetch_from_rdf(paths):
+    """
+    Run every query in TABLES on RDF dump files instead of on the SPARQL database.
+
+    Keyword arguments:
+    paths -- list of paths of RDF files in any format rdflib can guess from the extension (.ttl, .nt, .rdf, ...).
+    """
+    from rdflib import Graph, URIRef
+    from rdflib.util import guess_format
+
+    graph = Graph()
+    for path in paths:
+        graph.parse(path, format=guess_format(path))
+
+    results = []
+    for _, query, variables in TABLES:
+        rows = []
+        for row in graph.query(query):
+            rows.append({
+                variable: {
+                    'type': 'uri' if isinstance(row[variable], URIRef) else 'literal',
+                    'value': str(row[variable])
+                } for variable in variables
+            })
+        results.append(rows)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export or inspect a snapshot of the LBLOD candidate-list graph.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Export the graph from SPARQL_URL or from RDF dumps.')
+    export_parser.add_argument('path', help='Path of the snapshot file to write.')
+    export_parser.add_argument('--rdf', nargs='+', help='RDF dump files to read instead of querying SPARQL_URL.')
+    info_parser = subparsers.add_parser('info', help='Print the size of a snapshot.')
+    info_parser.add_argument('path', help='Path of the snapshot file to read.')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        results = fetch_from_rdf(args.rdf) if args.rdf else asyncio.run(fetch_from_sparql())
+        write(args.path, results)
+    print(SnapshotIndex(args.path).stats())
@@ -1,11 +1,229 @@
 """
 Functions to query the SPARQL database.
 """
-import requests
+import asyncio
+import re
+import time
 from os import environ
 
+import aiohttp
 
-def lblod_id_exists(lblod_id):
+import helper_json
+import helper_metrics
+import helper_queries
+from helper_cache import cached
+from helper_queries import INVALID_IRI
+
+DEFAULT_GRAPH_URI = 'http://api.sep.osoc.be/mandatendatabank'
+
+# The PREFIX declarations at the start of a query, which can't be part of a subquery
+PROLOGUE = re.compile(r'(?:\s*PREFIX\s+\w*:\s*<[^>]*>)*', re.I)
+
+
+# HTTP session shared by all queries of this worker, so connections to Virtuoso are pooled and kept alive.
+# It is created by `open_session` when the server starts and must only be used from the event loop.
+_session = None
+_semaphore = None
+
+
+class SparqlUnavailable(Exception):
+    """Raised when the SPARQL endpoint fails, times out or is skipped because the circuit breaker is open."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the SPARQL endpoint is down, instead of letting every request wait for a timeout.
+
+    After `threshold` consecutive failures the circuit opens and queries are rejected for `cooldown` seconds.
+    Then a single trial query is let through: the circuit closes when it succeeds and opens again when it fails.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        helper_metrics.SPARQL_CIRCUIT_OPEN.set(0)
+
+    @property
+    def is_open(self):
+        """Whether the circuit is open, which is also the case while a trial query is running."""
+        return self.opened_at is not None
+
+    def retry_after(self):
+        """Number of seconds until a trial query is let through."""
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic()) if self.is_open else 0.0
+
+    def allow(self):
+        """
+        Check if a query may be sent.
+
+        Returns:
+        Boolean reflecting whether the circuit is closed, or whether this query is the trial of a half-open circuit.
+        """
+        if self.threshold <= 0 or not self.is_open:
+            return True
+        if self._trial or self.retry_after() > 0:
+            return False
+        self._trial = True
+        return True
+
+    def end_trial(self):
+        """Let the next query be the trial when the trial query ended without an outcome, e.g. when it was cancelled."""
+        self._trial = False
+
+    def record_success(self):
+        """Close the circuit after a successful query."""
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        helper_metrics.SPARQL_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self):
+        """Count a failed query, opening the circuit after too many consecutive failures or a failed trial."""
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self._trial = False
+            helper_metrics.SPARQL_CIRCUIT_OPEN.set(1)
+
+
+breaker = CircuitBreaker(int(environ.get('SPARQL_BREAKER_THRESHOLD', 5)),
+                         float(environ.get('SPARQL_BREAKER_COOLDOWN', 30)))
+
+# In-memory election index (see helper_index) that answers the lookups below without a query when it is loaded.
+# It is replaced as a whole on every reload, so readers always see a complete index.
+index = None
+
+
+async def open_session():
+    """
+    Create the shared HTTP session that is used for all SPARQL queries.
+
+    The pool keeps at most SPARQL_POOL_SIZE keep-alive connections to Virtuoso, at most SPARQL_CONCURRENCY
+    queries are sent at the same time and every query is aborted after SPARQL_TIMEOUT seconds.
+    """
+    global _session, _semaphore
+    if _session is not None and not _session.closed:
+        return
+    connector = aiohttp.TCPConnector(limit=int(environ.get('SPARQL_POOL_SIZE', 20)),
+                                     keepalive_timeout=float(environ.get('SPARQL_KEEPALIVE', 30)))
+    timeout = aiohttp.ClientTimeout(total=float(environ.get('SPARQL_TIMEOUT', 10)))
+    _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    _semaphore = asyncio.Semaphore(int(environ.get('SPARQL_CONCURRENCY', 20)))
+
+
+async def close_session():
+    """Close the shared HTTP session and all of its pooled connections."""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def fetch(query, timeout=None, name='query'):
+    """
+    Send a query to the SPARQL endpoint and return the decoded JSON response.
+
+    Keyword arguments:
+    query -- string that satisfies the SPARQL query language syntax.
+    timeout -- optional number of seconds after which the query is aborted, overrides SPARQL_TIMEOUT_<NAME>
+        and SPARQL_TIMEOUT.
+    name -- name of the query in the metrics and the timeout configuration.
+
+    Returns:
+    The full JSON object returned by the SPARQL endpoint.
+        SparqlUnavailable is raised when the endpoint can't be reached, answers with a server error or invalid JSON
+        or times out, and when the circuit breaker is open. Other errors, like a rejected query, are raised as they are.
+    """
+    if not breaker.allow():
+        helper_metrics.SPARQL_SHORT_CIRCUITED.inc(name)
+        raise SparqlUnavailable('The SPARQL endpoint is unavailable', breaker.retry_after())
+    # Only the trial query of a half-open circuit is let through while the circuit is open
+    trial = breaker.is_open
+    try:
+        if _session is None or _session.closed:
+            await open_session()
+        sparql_url = environ.get('SPARQL_URL')
+        params = {
+            "default-graph-uri": DEFAULT_GRAPH_URI,
+            "format": "json",
+            "query": query
+        }
+        # Long queries, like the ones with a VALUES clause, could exceed the URL length limit of a GET request
+        method = 'POST' if len(query) > int(environ.get('SPARQL_POST_SIZE', 2048)) else 'GET'
+        if timeout is None and environ.get(f'SPARQL_TIMEOUT_{name.upper()}'):
+            timeout = float(environ.get(f'SPARQL_TIMEOUT_{name.upper()}'))
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+        async with _semaphore:
+            with helper_metrics.SPARQL_DURATION.time(name):
+                try:
+                    async with _session.request(method,
+                                                sparql_url,
+                                                params=params if method == 'GET' else None,
+                                                data=params if method == 'POST' else None,
+                                                timeout=request_timeout) as res:
+                        res.raise_for_status()
+                        # Decode the body directly instead of through aiohttp, which checks the content type and
+                        # uses json
+                        body = await res.read()
+                except aiohttp.ClientResponseError as error:
+                    helper_metrics.SPARQL_ERRORS.inc(name)
+                    if error.status < 500:
+                        # The endpoint is up but rejected the query
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    raise SparqlUnavailable(f'The SPARQL endpoint answered with status {error.status}') from error
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    helper_metrics.SPARQL_ERRORS.inc(name)
+                    breaker.record_failure()
+                    raise SparqlUnavailable(f'The SPARQL endpoint could not be reached: {error!r}') from error
+                except Exception:
+                    helper_metrics.SPARQL_ERRORS.inc(name)
+                    breaker.record_failure()
+                    raise
+        try:
+            results = helper_json.loads(body)
+        except ValueError as error:
+            # A truncated or garbled answer, like the error page of a proxy in front of an overloaded endpoint
+            helper_metrics.SPARQL_ERRORS.inc(name)
+            breaker.record_failure()
+            raise SparqlUnavailable(f'The SPARQL endpoint answered with invalid JSON: {error}') from error
+    finally:
+        if trial:
+            # Without this, a trial that is cancelled because the client disconnected would keep the circuit open
+            breaker.end_trial()
+    breaker.record_success()
+    return results
+
+
+async def probe(timeout=None):
+    """
+    Send a trivial query to the SPARQL endpoint directly, bypassing the circuit breaker.
+
+    The health checks use this: a failing probe doesn't open the circuit for the requests, and an open circuit
+    doesn't hide that the endpoint is back.
+
+    Keyword arguments:
+    timeout -- optional number of seconds after which the query is aborted, overrides SPARQL_TIMEOUT.
+    """
+    if _session is None or _session.closed:
+        await open_session()
+    params = {"default-graph-uri": DEFAULT_GRAPH_URI, "format": "json", "query": 'ASK {}'}
+    request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+    with helper_metrics.SPARQL_DURATION.time('probe'):
+        async with _session.get(environ.get('SPARQL_URL'), params=params, timeout=request_timeout) as res:
+            res.raise_for_status()
+            helper_json.loads(await res.read())
+
+
+async def lblod_id_exists(lblod_id):
     """
     Check if an lblod ID exists in the SPARQL database.
 
@@ -15,29 +233,42 @@ def lblod_id_exists(lblod_id):
     Returns:
     Boolean reflecting whether or not the lblod ID is stored in the database.
     """
-    sparql_url = environ.get('SPARQL_URL')
+    if index is not None:
+        return index.person_exists(lblod_id)
 
-    query = """
-    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX ns1: <http://www.w3.org/ns/person#>
-    ASK  {
-    <%s> rdf:type ns1:Person.
-    }""" % lblod_id
+    if not lblod_id or INVALID_IRI.search(lblod_id):
+        return False
 
-    res = requests.get(
-        sparql_url,
-        params={
-            "default-graph-uri": "http://api.sep.osoc.be/mandatendatabank",
-            "format": "json",
-            "query": query
-        }
-    )
-    results = res.json()
-    print(results['boolean'])
+    query = helper_queries.LBLOD_ID_EXISTS
+    results = await fetch(query.render(person=lblod_id), name=query.name)
     return bool(results['boolean'])
 
 
-def get_lblod_cities():
+async def lblod_ids_exist(lblod_ids):
+    """
+    Check which lblod IDs of a batch exist in the SPARQL database, with one query per SPARQL_VALUES_SIZE IDs.
+
+    Keyword arguments:
+    lblod_ids -- iterable of strings that represent the lblod IDs of which the existence will be checked.
+        IDs that are not valid IRIs are never sent to the database and don't exist.
+
+    Returns:
+    A set with the lblod IDs that are stored in the database.
+    """
+    lblod_ids = list({lblod_id for lblod_id in lblod_ids if lblod_id and not INVALID_IRI.search(lblod_id)})
+    if index is not None:
+        return {lblod_id for lblod_id in lblod_ids if index.person_exists(lblod_id)}
+
+    chunk_size = int(environ.get('SPARQL_VALUES_SIZE', 200))
+    existing = set()
+    for i in range(0, len(lblod_ids), chunk_size):
+        rows = await select(helper_queries.LBLOD_IDS_EXIST, persons=lblod_ids[i:i + chunk_size])
+        existing.update(row['person']['value'] for row in rows)
+    return existing
+
+
+@cached('cities')
+async def get_lblod_cities():
     """
     Get all the cities in the database.
 
@@ -65,33 +296,14 @@ def get_lblod_cities():
                 }
             ]
     """
-    query = """
-    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-    PREFIX org: <http://www.w3.org/ns/org#>
-    PREFIX core: <http://www.w3.org/2004/02/skos/core#>
-    PREFIX ns1: <http://data.vlaanderen.be/ns/mandaat#>
-    PREFIX ns2: <http://data.vlaanderen.be/ns/besluit#>
-    SELECT DISTINCT ?cityURI ?cityName ?locationLabel
-    WHERE {
-        ?list rdf:type ns1:Kandidatenlijst;
-        ns1:behoortTot ?election.
-        ?election ns1:steltSamen ?bestuursOrgaan.
-        ?bestuursOrgaan ns1:isTijdspecialisatieVan ?bestuursOrgaan2.
-        ?bestuursOrgaan2 ns2:bestuurt ?bestuursEenheid.
-        ?bestuursEenheid ns2:werkingsgebied ?cityURI;
-        ns2:classificatie ?classificationCode.
-        ?classificationCode core:prefLabel ?locationLabel.
-        ?cityURI rdfs:label ?cityName.
-        FILTER NOT EXISTS {
-            ?classificationCode core:prefLabel "OCMW"
-        }
-    }"""
+    if index is not None:
+        return index.cities()
 
-    return make_query(query)
+    return await select(helper_queries.CITIES)
 
 
-def get_lblod_lists(city_uri):
+@cached('lists')
+async def get_lblod_lists(city_uri):
     """
     Get all the lists in the database that are acitve in a city with given URI.
 
@@ -116,32 +328,14 @@ def get_lblod_lists(city_uri):
                 }
             ]
     """
-    query = """
-        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX core: <http://www.w3.org/2004/02/skos/core#>
-        PREFIX ns1: <http://data.vlaanderen.be/ns/mandaat#>
-        PREFIX ns2: <http://data.vlaanderen.be/ns/besluit#>
-        SELECT DISTINCT ?listURI ?listName
-        WHERE {
-            ?listURI rdf:type ns1:Kandidatenlijst;
-            core:prefLabel ?listName;
-            ns1:behoortTot ?election.
-            ?election ns1:steltSamen ?bestuursOrgaan.
-            ?bestuursOrgaan ns1:isTijdspecialisatieVan ?bestuursOrgaan2.
-            ?bestuursOrgaan2 ns2:bestuurt ?bestuursEenheid.
-            ?bestuursEenheid ns2:werkingsgebied <%s>;
-            ns2:classificatie ?classificationCode.
-            ?classificationCode core:prefLabel ?locationLabel.
-            FILTER NOT EXISTS {
-                ?classificationCode core:prefLabel "OCMW"
-            }
-        }""" % city_uri
-
-    return make_query(query)
-
-
-def get_lblod_candidates(list_uri):
+    if index is not None:
+        return index.lists(city_uri)
+
+    return await select(helper_queries.LISTS, city=city_uri)
+
+
+@cached('candidates')
+async def get_lblod_candidates(list_uri):
     """
     Get all the candidates in the database that campaign(ed) for a list with given URI.
 
@@ -172,23 +366,103 @@ def get_lblod_candidates(list_uri):
                 }
             ]
     """
-    query = """
-        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX foaf: <http://xmlns.com/foaf/0.1/>
-        PREFIX ns1: <http://data.vlaanderen.be/ns/mandaat#>
-        PREFIX ns2: <http://data.vlaanderen.be/ns/persoon#>
-        SELECT DISTINCT ?personURI ?name ?familyName
-        WHERE {
-            <%s> ns1:heeftKandidaat ?personURI.
-            ?personURI ns2:gebruikteVoornaam ?name;
-            foaf:familyName ?familyName.
-        }""" % list_uri
+    if index is not None:
+        return index.candidates(list_uri)
+
+    return await select(helper_queries.CANDIDATES, list=list_uri)
+
+
+def group_overview(rows):
+    """
+    Nest the rows of the CITY_OVERVIEW query by list.
+
+    Keyword arguments:
+    rows -- SPARQL bindings with "listURI", "listName" and the optional "trackingNb", "personURI", "name" and
+        "familyName".
+
+    Returns:
+    A list with an object per list, like the result of get_lblod_city_overview.
+    """
+    lists = {}
+    persons = {}
+    for row in rows:
+        list_uri = row['listURI']['value']
+        entry = lists.get(list_uri)
+        if entry is None:
+            entry = lists[list_uri] = {'listURI': row['listURI'], 'listName': row['listName'], 'candidates': []}
+            persons[list_uri] = set()
+        # A list with multiple names or tracking numbers repeats its candidates, only the first one is kept
+        if 'trackingNb' in row and 'trackingNb' not in entry:
+            entry['trackingNb'] = row['trackingNb']
+        if 'personURI' in row and row['personURI']['value'] not in persons[list_uri]:
+            persons[list_uri].add(row['personURI']['value'])
+            entry['candidates'].append({key: row[key] for key in ('personURI', 'name', 'familyName')})
+    return list(lists.values())
+
+
+@cached('overview')
+async def get_lblod_city_overview(city_uri):
+    """
+    Get all the lists of a city with their candidates, with a single query.
+
+    Keyword arguments:
+    city_uri -- string that represents the URI of the city of which all the lists will be searched.
+
+    Returns:
+    A list of objects with keys "listURI", "listName", "trackingNb" and "candidates".
+        "listURI" and "listName" are the bindings of get_lblod_lists.
+        "trackingNb" contains the tracking number of the list, it is missing when the list has none.
+        "candidates" contains the candidates of the list like the result of get_lblod_candidates.
+
+        Example:
+            [
+                {
+                    "listURI": {
+                        "type": "uri",
+                        "value": "http://data.lblod.info/id/kandidatenlijsten/091e6c1f-39b7-4ab4-8779-2f8ce77096b5"
+                    },
+                    "listName": {
+                        "type": "literal",
+                        "value": "OK"
+                    },
+                    "trackingNb": {
+                        "type": "literal",
+                        "value": "2"
+                    },
+                    "candidates": [
+                        {
+                            "personURI": {
+                                "type": "uri",
+                                "value": "http://data.lblod.info/id/personen/ed820a7da8c187ddb58a662737d9171d7522740b1c7727501d44d17c09b9afa8"
+                            },
+                            "name": {
+                                "type": "literal",
+                                "value": "Bart"
+                            },
+                            "familyName": {
+                                "type": "literal",
+                                "value": "Tommelein"
+                            }
+                        }
+                    ]
+                }
+            ]
+    """
+    if index is not None:
+        rows = []
+        for list_row in index.lists(city_uri):
+            list_uri = list_row['listURI']['value']
+            numbers = index.list_numbers(list_uri)
+            if numbers:
+                list_row = dict(list_row, trackingNb=numbers[0]['trackingNb'])
+            rows.extend({**list_row, **candidate} for candidate in index.candidates(list_uri) or ({}, ))
+        return group_overview(rows)
 
-    return make_query(query)
+    return group_overview(await select(helper_queries.CITY_OVERVIEW, city=city_uri))
 
 
-def get_lblod_person_info(person_uri):
+@cached('person')
+async def get_lblod_person_info(person_uri):
     """
     Get info about the person in the database with given URI.
 
@@ -231,44 +505,96 @@ def get_lblod_person_info(person_uri):
                 }
             ]
     """
-    query = """
-            PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-            PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-            PREFIX foaf: <http://xmlns.com/foaf/0.1/>
-            PREFIX core: <http://www.w3.org/2004/02/skos/core#>
-            PREFIX ns1: <http://data.vlaanderen.be/ns/mandaat#>
-            PREFIX ns2: <http://data.vlaanderen.be/ns/persoon#>
-            SELECT DISTINCT ?name ?familyName ?listURI ?listName ?trackingNb
-            WHERE {
-                <%s> ns2:gebruikteVoornaam ?name;
-                foaf:familyName ?familyName.
-                ?listURI ns1:heeftKandidaat <%s>;
-                core:prefLabel ?listName;
-                ns1:lijstnummer ?trackingNb.
-            }""" % (person_uri, person_uri)
+    if index is not None:
+        return index.person_info(person_uri)
 
-    return make_query(query)
+    return await select(helper_queries.PERSON, person=person_uri)
 
 
-def make_query(query):
+async def get_lblod_persons_info(person_uris):
+    """
+    Get info about multiple persons in the database, with one query per SPARQL_VALUES_SIZE URIs.
+
+    Keyword arguments:
+    person_uris -- list of strings that represent the URIs of the persons of which the info will be searched.
+        URIs that are not valid IRIs are skipped.
+
+    Returns:
+    A JSON object like the result of get_lblod_person_info, where every object has an extra key "personURI"
+    that contains the URI of the person the object is about.
+    """
+    person_uris = list(dict.fromkeys(uri for uri in person_uris if uri and not INVALID_IRI.search(uri)))
+    if index is not None:
+        return [{
+            'personURI': {
+                'type': 'uri',
+                'value': person_uri
+            },
+            **row
+        } for person_uri in person_uris for row in index.person_info(person_uri)]
+
+    chunk_size = int(environ.get('SPARQL_VALUES_SIZE', 200))
+    results = []
+    for i in range(0, len(person_uris), chunk_size):
+        results.extend(await select(helper_queries.PERSONS, persons=person_uris[i:i + chunk_size]))
+    return results
+
+
+async def make_query(query, timeout=None, name='query'):
     """
     Make a query to the SPARQL database.
 
     Keyword arguments:
     query -- string that satisfies the SPARQL query language syntax.
+    timeout -- optional number of seconds after which the query is aborted, overrides SPARQL_TIMEOUT.
+    name -- name of the query in the metrics.
 
     Returns:
     A JSON object that represents the result of the query.
     """
-    sparql_url = environ.get('SPARQL_URL')
+    results = await fetch(query, timeout=timeout, name=name)
+    return results['results']['bindings']
 
-    res = requests.get(
-        sparql_url,
-        params={
-            "default-graph-uri": "http://api.sep.osoc.be/mandatendatabank",
-            "format": "json",
-            "query": query
-        }
-    )
-    results = res.json()['results']['bindings']
-    return results
+
+async def select(query, timeout=None, **arguments):
+    """
+    Run a query of the registry in helper_queries.
+
+    Keyword arguments:
+    query -- the helper_queries.Query to run.
+    timeout -- optional number of seconds after which the query is aborted, overrides SPARQL_TIMEOUT.
+    arguments -- the IRIs of the parameters of the query.
+
+    Returns:
+    A JSON object that represents the result of the query. InvalidIRI is raised when an argument is not a valid IRI.
+    """
+    return await make_query(query.render(**arguments), timeout=timeout, name=query.name)
+
+
+async def make_paged_query(query, page_size=None, timeout=None, name='paged_query'):
+    """
+    Make a query to the SPARQL database and fetch all of its results, page by page.
+
+    Virtuoso truncates large result sets, so the results are requested in pages of SPARQL_PAGE_SIZE rows. The ordered
+    query is a subquery of every page, since Virtuoso refuses to sort for an OFFSET and LIMIT beyond its
+    MaxSortedTopRows (10000 by default), while it pages through the result of an ordered subquery without that limit.
+
+    Keyword arguments:
+    query -- string that satisfies the SPARQL query language syntax.
+        The query must have an ORDER BY clause so the pages are stable and must not have a LIMIT or OFFSET.
+    page_size -- optional number of rows per page, overrides SPARQL_PAGE_SIZE.
+    timeout -- optional number of seconds after which every page query is aborted, overrides SPARQL_TIMEOUT.
+    name -- name of the query in the metrics.
+
+    Returns:
+    A JSON object that represents the complete result of the query.
+    """
+    page_size = page_size or int(environ.get('SPARQL_PAGE_SIZE', 10000))
+    prologue = PROLOGUE.match(query).end()
+    results = []
+    while True:
+        page = await make_query(f'{query[:prologue]}\nSELECT * WHERE {{ {{ {query[prologue:].strip()} }} }}\n'
+                                f'LIMIT {page_size} OFFSET {len(results)}', timeout=timeout, name=name)
+        results.extend(page)
+        if len(page) < page_size:
+            return results
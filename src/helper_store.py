@@ -0,0 +1,216 @@
+"""
+Write-behind queue for the registrations of /store/, enabled with STORE_WRITE_BEHIND.
+
+Validated registrations are answered immediately with a token and stored in the background with one multi-row insert
+per STORE_FLUSH_SIZE registrations or STORE_FLUSH_INTERVAL milliseconds, whichever comes first. The outcome of a
+registration is kept by the worker that accepted it. Other workers, or the same worker after a restart, derive the
+outcome from the database, since the token contains the registration itself.
+"""
+import asyncio
+import base64
+import binascii
+import time
+from os import environ
+
+from sanic.log import logger
+
+import helper_json
+import helper_metrics
+import models
+from helper_cache import TTLCache
+
+# Number of seconds, on top of STORE_FLUSH_INTERVAL, that the batches queued before a registration and its own batch
+# get to be inserted, after which a registration that is neither stored nor known to this worker is reported as failed
+PENDING_MARGIN = 60
+
+PENDING = {'success': True, 'updated': False, 'pending': True, 'message': 'WebID will be added to the database'}
+STORED = {'success': True, 'updated': True, 'pending': False, 'message': 'WebID succesfully added to the database!'}
+EXISTS = {'success': True, 'updated': False, 'pending': False,
+          'message': 'WebID or lblod ID already exists in database'}
+FAILED = {'success': False, 'updated': False, 'pending': False,
+          'message': 'WebID could not be added to the database, please try again'}
+
+
+def enabled():
+    """Check if the write-behind queue is enabled with the STORE_WRITE_BEHIND environment variable."""
+    return bool(environ.get('STORE_WRITE_BEHIND'))
+
+
+def flush_interval():
+    """Get the maximum number of seconds a registration waits in the queue, from STORE_FLUSH_INTERVAL."""
+    return float(environ.get('STORE_FLUSH_INTERVAL', 50)) / 1000
+
+
+def pending_timeout():
+    """Get the number of seconds after which a registration that is neither stored nor known is reported as failed."""
+    return flush_interval() + PENDING_MARGIN
+
+
+def make_token(uri, lblod_id):
+    """
+    Build the token of a registration.
+
+    Keyword arguments:
+    uri -- the webID uri of the registration.
+    lblod_id -- the lblod ID of the registration.
+
+    Returns:
+    An URL-safe string that contains the registration and the time at which it was accepted.
+    """
+    data = helper_json.dumps([uri, lblod_id, round(time.time(), 3)])
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def read_token(token):
+    """
+    Read the registration from a token.
+
+    Keyword arguments:
+    token -- string that was returned by make_token.
+
+    Returns:
+    A tuple of the webID uri, the lblod ID and the time at which the registration was accepted,
+    or None if the token is not valid.
+    """
+    try:
+        uri, lblod_id, accepted = helper_json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if not isinstance(uri, str) or not isinstance(lblod_id, str) or not isinstance(accepted, (int, float)):
+        return None
+    return uri, lblod_id, accepted
+
+
+class WriteBehindQueue:
+    """
+    Queue of registrations that are inserted in batches.
+
+    A registration of which the uri or lblod ID is already queued is rejected immediately, the database rejects the
+    ones that conflict with stored webIDs when its batch is inserted.
+    """
+
+    def __init__(self, insert, interval, size, status_size, status_ttl):
+        """
+        Keyword arguments:
+        insert -- blocking function that inserts a list of tuples of a webID uri and an lblod ID, skipping the
+            conflicting ones, and returns a set with the inserted tuples.
+        interval -- maximum number of seconds a registration waits before its batch is inserted.
+        size -- maximum number of registrations per batch.
+        status_size -- maximum number of outcomes that are kept.
+        status_ttl -- number of seconds an outcome is kept.
+        """
+        self.insert = insert
+        self.interval = interval
+        self.size = size
+        self.status_ttl = status_ttl
+        self.outcomes = TTLCache(status_size)
+        self._queue = []  # list of tuples of token, uri and lblod ID
+        self._uris = set()
+        self._lblod_ids = set()
+        self._full = None
+        self._task = None
+        self._running = False
+
+    def __len__(self):
+        return len(self._uris)
+
+    def submit(self, uri, lblod_id):
+        """
+        Queue a registration.
+
+        Keyword arguments:
+        uri -- the webID uri, the lblod ID must have been validated.
+        lblod_id -- the lblod ID.
+
+        Returns:
+        The token of the registration, or None if the uri or lblod ID is already queued.
+        """
+        if uri in self._uris or lblod_id in self._lblod_ids:
+            return None
+        token = make_token(uri, lblod_id)
+        self._queue.append((token, uri, lblod_id))
+        self._uris.add(uri)
+        self._lblod_ids.add(lblod_id)
+        self.outcomes.set(('store', token), PENDING, self.status_ttl)
+        helper_metrics.STORE_QUEUE_LENGTH.set(len(self))
+        if len(self._queue) >= self.size and self._full is not None:
+            self._full.set()
+        return token
+
+    def outcome(self, token):
+        """Get the outcome of a registration that was accepted by this worker, or None if it is unknown."""
+        return self.outcomes.get(('store', token))
+
+    async def flush(self):
+        """Insert the next batch of queued registrations and record their outcomes."""
+        batch, self._queue = self._queue[:self.size], self._queue[self.size:]
+        try:
+            inserted = await models.run_in_db(self.insert, [(uri, lblod_id) for _, uri, lblod_id in batch])
+        except Exception:
+            logger.exception(f'Could not store a batch of {len(batch)} webIDs')
+            inserted = None
+        for token, uri, lblod_id in batch:
+            if inserted is None:
+                outcome = FAILED
+            else:
+                outcome = STORED if (uri, lblod_id) in inserted else EXISTS
+            self.outcomes.set(('store', token), outcome, self.status_ttl)
+            # The pair is released only now, so a registration that conflicts with an in-flight batch is rejected
+            self._uris.discard(uri)
+            self._lblod_ids.discard(lblod_id)
+        helper_metrics.STORE_QUEUE_LENGTH.set(len(self))
+
+    async def run(self):
+        """Insert the queued registrations at least every `interval` seconds, until the queue is stopped."""
+        while self._running:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            while self._queue:
+                await self.flush()
+
+    def start(self):
+        """Start inserting the queued registrations in the background."""
+        self._full = asyncio.Event()
+        self._running = True
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        """Stop inserting in the background and insert the registrations that are still queued."""
+        if self._task is not None:
+            # Let a running insert finish instead of cancelling it, so its outcomes are recorded
+            self._running = False
+            self._full.set()
+            await self._task
+            self._task = None
+        while self._queue:
+            await self.flush()
+
+
+queue = None
+
+
+def start(insert):
+    """
+    Create the write-behind queue of this worker and start inserting in the background.
+
+    Keyword arguments:
+    insert -- the blocking insert function of the queue, see WriteBehindQueue.
+    """
+    global queue
+    queue = WriteBehindQueue(insert,
+                             interval=flush_interval(),
+                             size=int(environ.get('STORE_FLUSH_SIZE', 500)),
+                             status_size=int(environ.get('STORE_STATUS_SIZE', 100000)),
+                             status_ttl=float(environ.get('STORE_STATUS_TTL', 3600)))
+    queue.start()
+
+
+async def stop():
+    """Insert the registrations that are still queued and remove the write-behind queue."""
+    global queue
+    if queue is not None:
+        await queue.stop()
+        queue = None
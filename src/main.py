@@ -5,35 +5,271 @@ This module defines and implements all the endpoints of the API.
 from sanic import Sanic, response
 from sanic_openapi import doc, swagger_blueprint
 from sanic_cors import CORS
-from playhouse.shortcuts import model_to_dict
-from peewee import IntegrityError, OperationalError, DoesNotExist
-from os import environ
-import sys
-from time import sleep
+from peewee import fn
+from os import cpu_count, environ
+from datetime import datetime
+from time import perf_counter, time
+import math
 
 import models
+import helper_cache
+import helper_format
+import helper_health
+import helper_http
+import helper_index
+import helper_json
+import helper_metrics
+import helper_persons
+import helper_queries
+import helper_search
+import helper_snapshot
 import helper_sparql
+import helper_store
 import documentation_models as doc_models
 
-app = Sanic('Test API')
+
+
+class MeteredSanic(Sanic):
+    """Sanic application that counts the requests in flight, including requests whose handler is cancelled."""
+
+    async def handle_request(self, request, write_callback, stream_callback):
+        helper_metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            return await super().handle_request(request, write_callback, stream_callback)
+        finally:
+            # The response middleware doesn't run when the client disconnects or RESPONSE_TIMEOUT passes
+            helper_metrics.REQUESTS_IN_FLIGHT.dec()
+
+
+app = MeteredSanic('Test API')
 app.blueprint(swagger_blueprint)
 app.config["API_TITLE"] = "Solid Elections API"
 app.config["API_DESCRIPTION"] = "Documentation of the Solid Elections API"
 CORS(app)
+# Requests that are in flight when the server stops get this many seconds to finish
+app.config.GRACEFUL_SHUTDOWN_TIMEOUT = float(environ.get('SHUTDOWN_TIMEOUT', 15))
+# Idle connections are kept open longer than the 90 seconds after which Traefik drops them, otherwise Traefik can send
+# a request on a connection that the worker is closing and answer 502
+app.config.KEEP_ALIVE = not environ.get('KEEP_ALIVE_DISABLED')
+app.config.KEEP_ALIVE_TIMEOUT = float(environ.get('KEEP_ALIVE_TIMEOUT', 95))
+app.config.REQUEST_TIMEOUT = float(environ.get('REQUEST_TIMEOUT', 60))
+app.config.RESPONSE_TIMEOUT = float(environ.get('RESPONSE_TIMEOUT', 60))
+app.config.REQUEST_MAX_SIZE = int(environ.get('REQUEST_MAX_SIZE', 100000000))
+
+# Content types of the bodies that compress_response compresses, most other types are compressed already
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/')
+
+
+@app.listener('before_server_start')
+async def open_sparql_session(app, loop):
+    """Create the pooled HTTP session for SPARQL queries in every worker."""
+    await helper_sparql.open_session()
+
+
+@app.listener('before_server_start')
+async def open_db_pool(app, loop):
+    """Create the database threads in every worker."""
+    models.open_pool()
+
+
+@app.listener('before_server_start')
+async def load_lblod_index(app, loop):
+    """Load the LBLOD snapshot, and reload the in-memory index, the dataset or the persons periodically if enabled."""
+    if environ.get('LBLOD_SNAPSHOT'):
+        helper_snapshot.load(environ.get('LBLOD_SNAPSHOT'))
+    if helper_index.enabled():
+        helper_index.start_reloading(float(environ.get('LBLOD_INDEX_REFRESH', 3600)))
+    elif environ.get('LBLOD_REFRESH') and helper_sparql.index is None:
+        # A loaded snapshot is the version of the dataset that is served, see helper_index.refresh
+        helper_index.start_reloading(float(environ.get('LBLOD_REFRESH')), helper_index.refresh)
+    if helper_persons.enabled() and not helper_index.enabled():
+        helper_persons.start_reloading(float(environ.get('LBLOD_PERSONS_REFRESH', 3600)))
+
+
+@app.listener('before_server_start')
+async def start_up(app, loop):
+    """Prepare the database, the SPARQL endpoint, the in-memory index and the cache in the background."""
+    helper_health.start()
+
+
+@app.listener('before_server_start')
+async def start_store_queue(app, loop):
+    """Start the write-behind queue of /store/, if it is enabled."""
+    if helper_store.enabled():
+        helper_store.start(insert_web_ids)
+
+
+@app.listener('before_server_stop')
+async def stop_store_queue(app, loop):
+    """Store the registrations that are still queued before the database pool is closed."""
+    await helper_store.stop()
+
+
+@app.listener('before_server_stop')
+async def stop_lblod_index(app, loop):
+    """Stop the startup and stop reloading the in-memory LBLOD index and the persons."""
+    helper_health.stop()
+    helper_index.stop_reloading()
+    helper_persons.stop_reloading()
+
+
+@app.listener('after_server_stop')
+async def close_sparql_session(app, loop):
+    """Close the pooled HTTP session for SPARQL queries."""
+    await helper_sparql.close_session()
+
+
+@app.listener('after_server_stop')
+async def close_db_pool(app, loop):
+    """Wait for the running database queries and close all connections in the database pool."""
+    models.close_pool()
 
 
-# Middleware to automatically open/close a database connection for every request
 @app.middleware('request')
-async def handle_request(request):
-    """Open database connection before each request is handled."""
-    models.db.connect()
+async def start_request_timer(request):
+    """Record the start of every request."""
+    request.ctx.start_time = perf_counter()
+    helper_cache.served_stale.set(False)
 
 
 @app.middleware('response')
-async def handle_response(request, response):
-    """Close database connection after each request is handled."""
-    if not models.db.is_closed():
-        models.db.close()
+async def observe_request_duration(request, response):
+    """Record the duration of every request in the metrics."""
+    if hasattr(request.ctx, 'start_time'):
+        route = getattr(request, 'uri_template', None) or 'unmatched'
+        helper_metrics.REQUEST_DURATION.observe(perf_counter() - request.ctx.start_time, route, request.method,
+                                                response.status)
+
+
+@app.middleware('response')
+async def mark_stale_response(request, response):
+    """Mark the responses that contain an expired SPARQL result, which is served while it is refreshed."""
+    if helper_cache.served_stale.get():
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['X-Cache-Status'] = 'stale'
+
+
+@app.middleware('response')
+async def compress_response(request, response):
+    """
+    Compress the bodies that are not built by helper_json.EncodedBody, like the /store/bulk results and the
+    documentation. These are compressed for every request, the cacheable responses reuse their compressed variants.
+    """
+    body = getattr(response, 'body', None)
+    if (body is None or len(body) < helper_json.COMPRESS_MIN_SIZE or 'Content-Encoding' in response.headers
+            or 'Content-Range' in response.headers or not (response.content_type or '').startswith(COMPRESSIBLE_TYPES)):
+        return
+    vary = response.headers.get('Vary')
+    if vary and 'accept-encoding' in vary.lower():
+        # The content coding was negotiated already, by an EncodedBody that wasn't compressed for this client
+        return
+    response.headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = helper_json.negotiate(request)
+    if encoding is None:
+        return
+    response.body = helper_json.compress(body, encoding)
+    response.headers['Content-Encoding'] = encoding
+    if 'Content-Length' in response.headers:
+        response.headers['Content-Length'] = len(response.body)
+    if 'ETag' in response.headers:
+        response.headers['ETag'] = helper_http.variant_etag(response.headers['ETag'], encoding)
+
+
+@app.exception(helper_sparql.SparqlUnavailable)
+async def sparql_unavailable(request, exception):
+    """Answer with 503 instead of 500 while the SPARQL endpoint is down and nothing is cached."""
+    headers = {}
+    if exception.retry_after:
+        headers['Retry-After'] = str(math.ceil(exception.retry_after))
+    return json_response({'success': False, 'message': 'The SPARQL endpoint is unavailable, please try again later'}, status=503, headers=headers)
+
+
+@app.exception(helper_search.SearchUnavailable)
+async def search_unavailable(request, exception):
+    """Answer /search with 503 while there is no dataset to search."""
+    return json_response({'success': False, 'message': 'Search is not available'}, status=503)
+
+
+@app.exception(helper_queries.InvalidIRI)
+async def invalid_iri(request, exception):
+    """Answer with 400 when a URI parameter is not a valid IRI, instead of sending it to the SPARQL endpoint."""
+    return json_response({'success': False, 'message': 'Wrong query parameters'}, status=400)
+
+
+def json_response(body, **kwargs):
+    """Build a JSON response like sanic.response.json with the fast encoder, recording the serialization time."""
+    with helper_metrics.JSON_DURATION.time():
+        return response.json(body, dumps=helper_json.dumps, **kwargs)
+
+
+@app.route('/healthz')
+@doc.summary("Check if the worker is alive.")
+async def r_healthz(req):
+    """
+    Check if the worker is alive, which is the case as long as it answers.
+
+    Returns:
+    The response contains the json name/value pair "alive", which is always true.
+    """
+    return json_response({'alive': True})
+
+
+@app.route('/readyz')
+@doc.summary("Check if the worker is ready to serve requests.")
+async def r_readyz(req):
+    """
+    Check if the worker is ready to serve requests.
+
+    The worker is ready once it has started up and Postgres answers.
+    The SPARQL endpoint has to answer as well, unless the lookups are served from an in-memory index or snapshot.
+
+    Returns:
+    The response has status 200 when the worker is ready and 503 otherwise.
+    It contains the json name/value pairs "ready", "startup_complete", "database", "sparql" and "index".
+        "database" and "sparql" contain the outcome of a probe query with "ok", "latency_ms" and optionally "error".
+        "index" denotes whether the lookups are served from an in-memory index or snapshot.
+
+        Example:
+            {
+                "ready": true,
+                "startup_complete": true,
+                "database": {"ok": true, "latency_ms": 1.204},
+                "sparql": {"ok": true, "latency_ms": 12.51},
+                "index": false
+            }
+    """
+    ready, details = await helper_health.readiness()
+    return json_response(details, status=200 if ready else 503)
+
+
+@app.route('/dataset')
+@doc.summary("Get the version of the LBLOD dataset that is served.")
+async def r_dataset(req):
+    """
+    Get the version of the LBLOD dataset that is served by this worker.
+
+    Returns:
+    The response contains the json name/value pairs "version", "refreshed" and "source".
+        "version" is a digest of the cities, lists and candidates, it only changes when one of them changes.
+            It is null until the dataset is fetched by the in-memory index, the snapshot or the periodic refresh.
+        "refreshed" is the Unix timestamp of the last time the dataset was fetched, or null.
+        "source" is "index" when the lookups are answered from an in-memory index or snapshot and "sparql" otherwise.
+
+        Example:
+            {
+                "version": "9f1c2b0d4e5a6f70",
+                "refreshed": 1602934567.123,
+                "source": "sparql"
+            }
+    """
+    return json_response(helper_index.status(), headers={'Cache-Control': 'no-store'})
+
+
+@app.route('/metrics')
+@doc.exclude(True)
+async def r_metrics(req):
+    """Get the metrics of this worker in the Prometheus text exposition format."""
+    return response.text(helper_metrics.render(helper_sparql.index), content_type='text/plain; version=0.0.4')
 
 
 @app.route('/store/', methods=['POST'])
@@ -65,34 +301,202 @@ async def r_store(req):
                 "updated": True,
                 "message": "WebID successfully added to the database!"
             }
+
+    When STORE_WRITE_BEHIND is set, a valid pair is stored in the background and the response has status 202 with
+    "updated" set to False and the extra name/value pairs "pending" and "token".
+        "pending" is True while the pair is not stored yet.
+        "token" can be passed to /store/status to get the outcome once the pair is stored.
     """
 
     # Get 'uri' and 'lblod_id' from JSON body and throw HTTP/400 if one of them is missing
     uri = req.json.get('uri')
     lblod_id = req.json.get('lblod_id')
     if not uri or not lblod_id:
-        return response.json({'success': False, 'updated': False, 'message': 'Please set the "uri" and "lblod_id" fields in your JSON body'}, status=400)
+        return json_response({'success': False, 'updated': False, 'message': 'Please set the "uri" and "lblod_id" fields in your JSON body'}, status=400)
+
+    if not await helper_persons.lblod_id_exists(lblod_id):
+        return json_response({'success': False, 'updated': False, 'message': 'This lblod ID does not exist in our dataset'}, status=400)
+
+    if helper_store.queue is not None:
+        token = helper_store.queue.submit(uri, lblod_id)
+        if token is None:
+            return json_response(helper_store.EXISTS, status=400)
+        return json_response(dict(helper_store.PENDING, token=token), status=202)
+
+    # Try to add the data to the database, throw HTTP/400 if user tries to add an existing value.
+    # The insert skips conflicting rows and returns the inserted ones, so a duplicate doesn't need a second round trip.
+    if not await models.run_in_db(insert_web_ids, [(uri, lblod_id)]):
+        return json_response({'success': True, 'updated': False, 'message': 'WebID or lblod ID already exists in database'}, status=400)
+
+    return json_response({'success': True, 'updated': True, 'message': 'WebID succesfully added to the database!'})
+
+
+@app.route('/store/status', methods=['GET'])
+@doc.summary("Get the outcome of a registration that is stored in the background.")
+@doc.consumes(doc.String(name="token", description="Token of the registration, as returned by /store/."), location="query")
+@doc.produces(doc_models.StoreStatusResponse, description="The response formulates the outcome of the registration.")
+async def r_store_status(req):
+    """
+    Get the outcome of a registration that was accepted by /store/ to be stored in the background.
+
+    Keyword arguments:
+    The request should contain the "token" returned by /store/.
+        Example:
+            /store/status?token=WyJodHRwczovL2pvbmFzdmVydmxvZXQuaW5ydXB0Lm5ldC9wcm9maWxlL2NhcmQjbWUiLC4uLl0
+
+    Returns:
+    The response contains json name/value pairs "success", "updated", "pending" and "message", like /store/.
+        "pending" is True while the pair is not stored yet.
+        "updated" is True once the pair is stored, and stays False when the webID uri or lblod uri already existed.
+        "success" is False when the token is not valid or the pair could not be stored, it should then be sent again.
+
+        Example:
+            {
+                "success": true,
+                "updated": true,
+                "pending": false,
+                "message": "WebID succesfully added to the database!"
+            }
+    """
+    token = req.args.get('token', '')
+    registration = helper_store.read_token(token)
+    if registration is None:
+        return json_response({'success': False, 'updated': False, 'pending': False, 'message': 'Wrong query parameters'}, status=400)
+
+    outcome = helper_store.queue.outcome(token) if helper_store.queue is not None else None
+    if outcome is None:
+        # The registration was accepted by another worker or before a restart, so the database has the final say
+        uri, lblod_id, accepted = registration
+        stored = await models.run_in_db(get_web_id_conflicts, uri, lblod_id)
+        created = stored.get((uri, lblod_id))
+        # A pair that was stored before the token was issued was stored by another registration, this one was
+        # rejected as a duplicate. The timestamp of the token is rounded to the millisecond.
+        if created is not None and created.timestamp() > accepted - 0.001:
+            outcome = helper_store.STORED
+        elif stored:
+            outcome = helper_store.EXISTS
+        elif time() - accepted < helper_store.pending_timeout():
+            outcome = helper_store.PENDING
+        else:
+            outcome = helper_store.FAILED
+    return json_response(outcome, headers={'Cache-Control': 'no-store'})
+
+
+@app.route('/store/bulk', methods=['POST'])
+@doc.summary("Store multiple webIDs in the database given pairs of a valid webID uri and a lblod uri.")
+@doc.consumes(doc.List(doc_models.StoreRequestBody), location="body")
+@doc.produces(doc_models.StoreBulkResponse, description="The response formulates the outcome of every pair.")
+async def r_store_bulk(req):
+    """
+    Store multiple webIDs in the database given pairs of a valid webID uri and a lblod uri.
+
+    All lblod uris are validated together and all valid pairs are inserted with a single query.
+
+    Keyword arguments:
+    The request body should be a json array of objects with "uri" and "lblod_id" fields like the body of /store/.
+    With the "application/x-ndjson" content type, the body can also contain one such object per line.
+        Example:
+            [
+                {
+                    "uri": "https://jonasvervloet.inrupt.net/profile/card#me",
+                    "lblod_id": "http://data.lblod.info/id/personen/41e449eafddf2c0c2365a294376780293d92fb401241589a1f403cdff8d2ce5a"
+                }
+            ]
 
-    if not helper_sparql.lblod_id_exists(lblod_id):
-        return response.json({'success': False, 'updated': False, 'message': 'This lblod ID does not exist in our dataset'}, status=400)
+    Returns:
+    The response contains json name/value pairs "success" and "result".
+        "success" denotes if the body could be read.
+        "result" contains the outcome of every pair in the order of the request,
+            with the fields of the /store/ response and the "uri" and "lblod_id" of the pair.
+            A pair that repeats the webID uri or lblod uri of an earlier pair in the same request is not stored.
 
-    # Try to add the data to the database, throw HTTP/400 if user tries to add an existing value
-    web_id = models.WebID(uri=uri, lblod_id=lblod_id)
+        Example:
+            {
+                "success": true,
+                "result": [
+                    {
+                        "uri": "https://jonasvervloet.inrupt.net/profile/card#me",
+                        "lblod_id": "http://data.lblod.info/id/personen/41e449eafddf2c0c2365a294376780293d92fb401241589a1f403cdff8d2ce5a",
+                        "success": true,
+                        "updated": true,
+                        "message": "WebID succesfully added to the database!"
+                    }
+                ]
+            }
+    """
     try:
-        web_id.save()
-    except IntegrityError:
-        return response.json({'success': True, 'updated': False, 'message': 'WebID or lblod ID already exists in database'}, status=400)
+        if 'ndjson' in req.content_type:
+            items = [helper_json.loads(line) for line in req.body.decode('utf-8').splitlines() if line.strip()]
+        else:
+            items = req.json
+    except ValueError:
+        items = None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return json_response({'success': False, 'message': 'Please send a JSON array of objects with "uri" and "lblod_id" fields'}, status=400)
 
-    return response.json({'success': True, 'updated': True, 'message': 'WebID succesfully added to the database!'})
+    max_items = int(environ.get('STORE_BULK_MAX', 1000))
+    if len(items) > max_items:
+        return json_response({'success': False, 'message': f'Please send at most {max_items} items per request'}, status=400)
+
+    # Fields that are not strings are treated as missing
+    pairs = [tuple(item.get(key) if isinstance(item.get(key), str) else None for key in ('uri', 'lblod_id'))
+             for item in items]
+    existing = await helper_persons.lblod_ids_exist(lblod_id for uri, lblod_id in pairs if uri and lblod_id)
+
+    # Pairs that can be inserted, a uri or lblod ID that is already used by an earlier pair of the batch conflicts
+    valid = []
+    seen_uris, seen_lblod_ids = set(), set()
+    for uri, lblod_id in pairs:
+        if uri and lblod_id in existing and uri not in seen_uris and lblod_id not in seen_lblod_ids:
+            valid.append((uri, lblod_id))
+        seen_uris.add(uri)
+        seen_lblod_ids.add(lblod_id)
+    inserted = await models.run_in_db(insert_web_ids, valid)
+
+    result = []
+    for uri, lblod_id in pairs:
+        if not uri or not lblod_id:
+            outcome = (False, False, 'Please set the "uri" and "lblod_id" fields in your JSON body')
+        elif lblod_id not in existing:
+            outcome = (False, False, 'This lblod ID does not exist in our dataset')
+        elif (uri, lblod_id) in inserted:
+            outcome = (True, True, 'WebID succesfully added to the database!')
+            # Report only the first of identical pairs in the batch as added
+            inserted.discard((uri, lblod_id))
+        else:
+            outcome = (True, False, 'WebID or lblod ID already exists in database')
+        result.append({
+            'uri': uri,
+            'lblod_id': lblod_id,
+            'success': outcome[0],
+            'updated': outcome[1],
+            'message': outcome[2]
+        })
+    return json_response({'success': True, 'result': result})
 
 
 @app.route('/get')
 @doc.summary("Get all stored webIDs in the database.")
+@doc.consumes(doc.Integer(name="after_id", description="Only return entries with a higher id, for pagination."), location="query")
+@doc.consumes(doc.Integer(name="limit", description="Maximum number of entries to return."), location="query")
+@doc.consumes(doc.String(name="since", description="Only return entries created at or after this ISO 8601 date."), location="query")
+@doc.consumes(doc.Boolean(name="stream", description="Stream the entries instead of sending them at once."), location="query")
 @doc.produces(doc.List(doc_models.GetResponseEntry), description="List of all entries in the database.")
 async def r_get(req):
     """
     Get all stored webIDs in the database.
 
+    Keyword arguments:
+    The request can contain the optional parameters "after_id", "limit", "since" and "stream".
+        "after_id" only returns the entries with a higher id. The entries are ordered by id, so the next page
+            of a paginated listing is requested with the id of the last entry of the previous page.
+        "limit" returns at most this many entries.
+        "since" only returns the entries that were created at or after this ISO 8601 date.
+        "stream" set to "true" streams the entries as they are read from the database,
+            so even the full table is sent without loading it in memory at once.
+        Example:
+            /get?after_id=73&limit=100&since=2020-07-27
+
     Returns:
     The response contains a list of json objects with fields "id", "uri", "lblod_id", "date_created".
     Each object corresponds with an entry stored in the database.
@@ -111,16 +515,60 @@ async def r_get(req):
                 }
             ]
     """
-    return response.json(get_web_ids())
+    try:
+        after_id = int(req.args['after_id'][0]) if 'after_id' in req.args else None
+        limit = int(req.args['limit'][0]) if 'limit' in req.args else None
+        since = datetime.fromisoformat(req.args['since'][0]) if 'since' in req.args else None
+    except ValueError:
+        return json_response({'message': 'Wrong query parameters', 'success': False}, status=400)
+    if limit is not None and limit < 0:
+        return json_response({'message': 'Wrong query parameters', 'success': False}, status=400)
+
+    # The table only grows, so its highest id and row count identify the result without running the query
+    tag = helper_http.etag(await models.run_in_db(get_web_ids_version), req.query_string)
+    if helper_http.matches(req, tag):
+        return helper_http.not_modified('get', tag, {'Vary': 'Accept-Encoding'})
+
+    if req.args.get('stream', '').lower() not in ('true', '1'):
+        body = helper_json.EncodedBody(await models.run_in_db(get_web_ids, after_id, limit, since))
+        return body.response(req, namespace='get', etag=tag)
+
+    async def stream_web_ids(res):
+        # Read the table in pages, so no database connection is held while waiting for a slow client
+        batch_size = int(environ.get('GET_STREAM_BATCH', 500))
+        last_id, remaining = after_id, limit
+        await res.write('[')
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            web_ids = await models.run_in_db(get_web_ids, last_id, size, since)
+            if web_ids:
+                await res.write((b',' if last_id != after_id else b'') + b','.join(map(helper_json.dumps, web_ids)))
+                last_id = web_ids[-1]['id']
+            if remaining is not None:
+                remaining -= len(web_ids)
+            if len(web_ids) < size:
+                break
+        await res.write(']')
+
+    return response.stream(stream_web_ids, content_type='application/json', headers=helper_http.caching_headers('get', tag))
 
 
 @app.route('/cities', methods=['GET'])
 @doc.summary("Get all the cities in the database.")
+@doc.consumes(doc.String(name="format", description="Response format: \"sparql\" (default), \"compact\" or \"columns\"."), location="query")
 @doc.produces(doc_models.CityResponse, description="The response gives the success of the request as well as the result of the request.")
 async def get_handler(req):
     """
     Get all the cities in the database.
 
+    Keyword arguments:
+    The optional parameter "format" selects the encoding of the result.
+        "sparql" (default) returns every value as a SPARQL binding with "type" and "value", as in the example below.
+        "compact" returns every value as a plain string.
+        "columns" returns one object that maps every field to the list of its values, with null for a missing value.
+        Example:
+            /cities?format=compact
+
     Returns:
     The result contains two value/name pairs: "success" and "result".
         "success" denotes whether the request was handled successfully.
@@ -149,18 +597,22 @@ async def get_handler(req):
                 ]
             }
     """
-    cities = helper_sparql.get_lblod_cities()
-    return response.json(
-        {
-            'success': True,
-            'result': cities
-        }
-    )
+    result_format = helper_format.requested_format(req)
+    if result_format is None:
+        return json_response({'message': 'Wrong query parameters', 'success': False}, status=400)
+    cities = await helper_sparql.get_lblod_cities()
+    # The body only depends on the cached cities, so it is serialized once per cached result
+    body = helper_json.encoded_body(('cities', result_format), cities, lambda cities: {
+        'success': True,
+        'result': helper_format.encode(cities, result_format)
+    })
+    return body.response(req, namespace='cities')
 
 
 @app.route('/lists', methods=['GET'])
 @doc.summary("Get all lists that are active for a given city.")
 @doc.consumes(doc.String(name="cityURI", description="URI of the city of which all the lists will be searched."), location="query")
+@doc.consumes(doc.String(name="format", description="Response format: \"sparql\" (default), \"compact\" or \"columns\"."), location="query")
 @doc.produces(doc_models.ListResponse, description="The response gives the success of the request as well as the result of the request.")
 async def get_handler(req):
     """
@@ -170,6 +622,10 @@ async def get_handler(req):
     The request should contain a valid parameter for "cityURI".
         Example:
             /lists?cityURI=http://data.lblod.info/id/werkingsgebieden/39173049fa95c468999d3862c3e6d22184c604d0864d6e56d1660886e17ca3c7
+    The optional parameter "format" selects the encoding of the result.
+        "sparql" (default) returns every value as a SPARQL binding with "type" and "value", as in the example below.
+        "compact" returns every value as a plain string.
+        "columns" returns one object that maps every field to the list of its values, with null for a missing value.
 
     Returns:
     The result contains two value/name pairs: "success" and "result".
@@ -195,28 +651,122 @@ async def get_handler(req):
                 ]
             }
     """
+    result_format = helper_format.requested_format(req)
+    if result_format is None:
+        return json_response({'message': 'Wrong query parameters', 'success': False}, status=400)
     try:
         city_uri = req.args['cityURI'][0]
     except KeyError:
-        return response.json(
+        return json_response(
             {
                 'message': 'Wrong query parameters',
                 'succes': False
             },
             status=400
         )
-    lists = helper_sparql.get_lblod_lists(city_uri)
-    return response.json(
-        {
-            'success': True,
-            'result': lists
-        }
-    )
+    lists = await helper_sparql.get_lblod_lists(city_uri)
+    body = helper_json.encoded_body(('lists', city_uri, result_format), lists, lambda lists: {
+        'success': True,
+        'result': helper_format.encode(lists, result_format)
+    })
+    return body.response(req, namespace='lists')
+
+
+@app.route('/cities/overview', methods=['GET'])
+@doc.summary("Get all lists of a city with their candidates in one request.")
+@doc.consumes(doc.String(name="cityURI", description="URI of the city of which all the lists will be searched."), location="query")
+@doc.consumes(doc.String(name="format", description="Response format: \"sparql\" (default), \"compact\" or \"columns\"."), location="query")
+@doc.produces(doc_models.OverviewResponse, description="The response gives the success of the request as well as the result of the request.")
+async def get_handler(req):
+    """
+    Get all lists of a city with their candidates in one request, instead of a request to /lists and one to /candidates per list.
+
+    Keyword arguments:
+    The request should contain a valid parameter for "cityURI".
+        Example:
+            /cities/overview?cityURI=http://data.lblod.info/id/werkingsgebieden/39173049fa95c468999d3862c3e6d22184c604d0864d6e56d1660886e17ca3c7
+    The optional parameter "format" selects the encoding of the result.
+        "sparql" (default) returns every value as a SPARQL binding with "type" and "value", as in the example below.
+        "compact" returns every value as a plain string.
+        "columns" returns the fields of a list as plain strings and the candidates of a list as one object that maps
+        every field to the list of its values, with null for a missing value.
+
+    Returns:
+    The result contains two value/name pairs: "success" and "result".
+        "success" denotes whether the request was handled successfully.
+            This is set to False when the required parameters are not present.
+        "result" contains the actual result that is a list of json objects that contain "listURI", "listName", <optional>"trackingNb" and "candidates".
+            "listURI" contains the uri of the list which can be used to identify the list.
+            "listName" contains the name of the list.
+            "trackingNb"<optional> contains the tracking number of the list.
+            "candidates" contains the candidates of the list, like the result of /candidates including their "webID".
+
+        Example:
+            {
+                "success": true,
+                "result": [
+                    {
+                        "listURI": {
+                            "type": "uri",
+                            "value": "http://data.lblod.info/id/kandidatenlijsten/091e6c1f-39b7-4ab4-8779-2f8ce77096b5"
+                        },
+                        "listName": {
+                            "type": "literal",
+                            "value": "OK"
+                        },
+                        "trackingNb": {
+                            "type": "literal",
+                            "value": "2"
+                        },
+                        "candidates": [
+                            {
+                                "personURI": {
+                                    "type": "uri",
+                                    "value": "http://data.lblod.info/id/personen/ed820a7da8c187ddb58a662737d9171d7522740b1c7727501d44d17c09b9afa8"
+                                },
+                                "name": {
+                                    "type": "literal",
+                                    "value": "Bart"
+                                },
+                                "familyName": {
+                                    "type": "literal",
+                                    "value": "Tommelein"
+                                },
+                                "webID": {
+                                    "type": "literal",
+                                    "value": "https://bert1.solid.community/profile/card#me"
+                                }
+                            }
+                        ]
+                    }
+                ]
+            }
+    """
+    result_format = helper_format.requested_format(req)
+    city_uri = req.args.get('cityURI')
+    if not city_uri or result_format is None:
+        return json_response({'message': 'Wrong query parameters', 'success': False}, status=400)
+    lists = await helper_sparql.get_lblod_city_overview(city_uri)
+    # The webIDs of all candidates of the city are read with a single query
+    candidates = iter(await add_web_ids([candidate for entry in lists for candidate in entry['candidates']], 'personURI'))
+    result = []
+    for entry in lists:
+        fields = {key: binding for key, binding in entry.items() if key != 'candidates'}
+        result.append({
+            **(fields if result_format == 'sparql' else helper_format.compact([fields])[0]),
+            'candidates': helper_format.encode([next(candidates) for _ in entry['candidates']], result_format)
+        })
+    body = helper_json.EncodedBody({
+        'success': True,
+        'result': result
+    })
+    return body.response(req, namespace='overview')
 
 
 @app.route('/candidates', methods=['GET'])
 @doc.summary("Get all candidates that are on a given list.")
 @doc.consumes(doc.String(name="listURI", description="URI of the list of which all the candidates will be searched."), location="query")
+@doc.consumes(doc.String(name="format", description="Response format: \"sparql\" (default), \"compact\" or \"columns\"."), location="query")
 @doc.produces(doc_models.CandidateResponse, description="The response gives the success of the request as well as the result of the request.")
 async def get_handler(req):
     """
@@ -226,6 +776,10 @@ async def get_handler(req):
     The request should contain a valid parameter for "listURI".
         Example:
             /candidates?listURI=http://data.lblod.info/id/kandidatenlijsten/078a1ef8-0875-48b2-b8fc-6167f5cfa3c0
+    The optional parameter "format" selects the encoding of the result.
+        "sparql" (default) returns every value as a SPARQL binding with "type" and "value", as in the example below.
+        "compact" returns every value as a plain string.
+        "columns" returns one object that maps every field to the list of its values, with null for a missing value.
 
     Returns:
     The result contains two value/name pairs: "success" and "result".
@@ -263,46 +817,47 @@ async def get_handler(req):
                 ]
             }
     """
+    result_format = helper_format.requested_format(req)
+    if result_format is None:
+        return json_response({'message': 'Wrong query parameters', 'success': False}, status=400)
     try:
         list_uri = req.args['listURI'][0]
     except KeyError:
-        return response.json(
+        return json_response(
             {
                 'message': 'Wrong query parameters',
                 'succes': False,
             },
             status=400
         )
-    candidates = helper_sparql.get_lblod_candidates(list_uri)
-    for candidate in candidates:
-        try:
-            web_id_uri = get_web_id(candidate['personURI']['value'])
-            candidate['webID'] = {
-                'type': 'literal',
-                'value': web_id_uri
-            }
-        except DoesNotExist:
-            continue
-    return response.json(
-        {
-            'success': True,
-            'result': candidates
-        }
-    )
-
-
-@app.route('/person', methods=['GET'])
-@doc.summary("Get info about a person given the persons' uri.")
-@doc.consumes(doc.String(name="lblodURI", description="URI of the person of which the info will be searched."), location="query")
-@doc.produces(doc_models.CandidateResponse, description="The response gives the success of the request as well as the result of the request.")
+    candidates = await add_web_ids(await helper_sparql.get_lblod_candidates(list_uri), 'personURI')
+    body = helper_json.EncodedBody({
+        'success': True,
+        'result': helper_format.encode(candidates, result_format)
+    })
+    return body.response(req, namespace='candidates')
+
+
+@app.route('/person', methods=['GET', 'POST'])
+@doc.summary("Get info about a person given the persons' uri, or about multiple persons at once.")
+@doc.consumes(doc.String(name="personURI", description="URI of the person of which the info will be searched."), location="query")
+@doc.consumes(doc.List(doc.String()), location="body")
+@doc.consumes(doc.String(name="format", description="Response format: \"sparql\" (default), \"compact\" or \"columns\"."), location="query")
+@doc.produces(doc_models.PersonResponse, description="The response gives the success of the request as well as the result of the request.")
 async def get_handler(req):
     """
-    Get info about a person given the persons' uri.
+    Get info about a person given the persons' uri, or about multiple persons at once.
 
     Keyword arguments:
-    The request should contain a valid parameter for "lblodURI".
+    The request should contain a valid parameter for "personURI".
         Example:
-            /person?lblodURI=http://data.lblod.info/id/personen/4bfe62e576c4f955a3080ad38a213a66a8896e7ac9e6029b5185947b1c8427cc
+            /person?personURI=http://data.lblod.info/id/personen/4bfe62e576c4f955a3080ad38a213a66a8896e7ac9e6029b5185947b1c8427cc
+    The "personURI" parameter can be repeated to get info about multiple persons with one request.
+    Multiple persons can also be requested with a POST request with a json array of person uris as body.
+    The optional parameter "format" selects the encoding of the result.
+        "sparql" (default) returns every value as a SPARQL binding with "type" and "value", as in the example below.
+        "compact" returns every value as a plain string.
+        "columns" returns one object that maps every field to the list of its values, with null for a missing value.
 
     Returns:
     The result contains two value/name pairs: "success" and "result".
@@ -316,6 +871,9 @@ async def get_handler(req):
             "listURI" contains uri of a list where the person is on.
             "listName" contains the name of the list.
             "trackingNb" contains the tracking number of the list.
+            "webID"<optional> contains the webID uri that is linked to the person.
+                This webID field is only present if there is an entry in our database with the personURI.
+            "personURI"<only for multiple persons> contains the uri of the person the object is about.
 
         Example:
             {
@@ -346,28 +904,146 @@ async def get_handler(req):
                 ]
             }
     """
-    try:
-        person_uri = req.args['personURI'][0]
-    except KeyError:
-        return response.json(
+    if req.method == 'POST':
+        person_uris = req.json
+    else:
+        person_uris = req.args.getlist('personURI')
+    result_format = helper_format.requested_format(req)
+    if (not person_uris or not isinstance(person_uris, list) or not all(isinstance(uri, str) for uri in person_uris)
+            or result_format is None):
+        return json_response(
             {
                 'message': 'Wrong query parameters',
                 'succes': False,
             },
             status=400
         )
-    info = helper_sparql.get_lblod_person_info(person_uri)
-    return response.json(
-        {
-            'success': True,
-            'result': info
-        }
-    )
+    max_persons = int(environ.get('PERSON_BATCH_MAX', 100))
+    if len(person_uris) > max_persons:
+        return json_response({'message': f'Please request at most {max_persons} persons at once', 'success': False}, status=400)
+
+    if req.method == 'GET' and len(person_uris) == 1:
+        info = await helper_sparql.get_lblod_person_info(person_uris[0])
+        web_ids = await models.run_in_db(get_web_id_map, person_uris)
+        if person_uris[0] in web_ids:
+            web_id = {'type': 'literal', 'value': web_ids[person_uris[0]]}
+            info = [dict(row, webID=web_id) for row in info]
+    else:
+        info = await add_web_ids(await helper_sparql.get_lblod_persons_info(person_uris), 'personURI')
+    body = helper_json.EncodedBody({
+        'success': True,
+        'result': helper_format.encode(info, result_format)
+    })
+    return body.response(req, namespace='person')
+
+
+@app.route('/search', methods=['GET'])
+@doc.summary("Search cities, lists and candidates by name.")
+@doc.consumes(doc.String(name="q", description="Text to search, every word has to match the start of a word of a name."), location="query")
+@doc.consumes(doc.String(name="type", description="Optional kind of result: \"city\", \"list\" or \"candidate\", can be repeated."), location="query")
+@doc.consumes(doc.Integer(name="limit", description="Maximum number of results, 20 by default."), location="query")
+@doc.consumes(doc.String(name="format", description="Response format: \"sparql\" (default), \"compact\" or \"columns\"."), location="query")
+@doc.produces(doc_models.SearchResponse, description="The response gives the success of the request as well as the result of the request.")
+async def get_handler(req):
+    """
+    Search cities, lists and candidates by name, for autocompletion.
+
+    Keyword arguments:
+    The request should contain a parameter "q" with the text to search.
+        Every word of the text has to match the start of a word of the name of a city, list or candidate, ignoring
+        case and accents. When there are too few of those results, words with a similar spelling match as well.
+        Example:
+            /search?q=tommel&type=candidate
+    The optional parameter "type" only returns results of a kind: "city", "list" or "candidate". It can be repeated.
+    The optional parameter "limit" sets the maximum number of results, 20 by default and at most SEARCH_MAX_LIMIT.
+    The optional parameter "format" selects the encoding of the result.
+        "sparql" (default) returns every value as a SPARQL binding with "type" and "value", as in the example below.
+        "compact" returns every value as a plain string.
+        "columns" returns one object that maps every field to the list of its values, with null for a missing value.
+
+    Returns:
+    The result contains two value/name pairs: "success" and "result".
+        "success" denotes whether the request was handled successfully.
+            This is set to False when the required parameters are not present.
+        "result" contains the best matches first, as a list of json objects that contain "kind" and the fields of the
+        match.
+            "kind" is "city", "list" or "candidate".
+            A city contains "cityURI", "cityName" and "locationLabel", like the result of /cities.
+            A list contains "listURI" and "listName", like the result of /lists, and the "cityURI" and "cityName" of
+            its city.
+            A candidate contains "personURI", "name" and "familyName", like the result of /candidates, and the
+            "listURI", "listName", "cityURI" and "cityName" of its list. A person on multiple lists is returned once per
+            list.
+
+        Example:
+            {
+                "success": true,
+                "result": [
+                    {
+                        "personURI": {
+                            "type": "uri",
+                            "value": "http://data.lblod.info/id/personen/ed820a7da8c187ddb58a662737d9171d7522740b1c7727501d44d17c09b9afa8"
+                        },
+                        "name": {
+                            "type": "literal",
+                            "value": "Bart"
+                        },
+                        "familyName": {
+                            "type": "literal",
+                            "value": "Tommelein"
+                        },
+                        "listURI": {
+                            "type": "uri",
+                            "value": "http://data.lblod.info/id/kandidatenlijsten/078a1ef8-0875-48b2-b8fc-6167f5cfa3c0"
+                        },
+                        "listName": {
+                            "type": "literal",
+                            "value": "Open Vld"
+                        },
+                        "cityURI": {
+                            "type": "uri",
+                            "value": "http://data.lblod.info/id/werkingsgebieden/39173049fa95c468999d3862c3e6d22184c604d0864d6e56d1660886e17ca3c7"
+                        },
+                        "cityName": {
+                            "type": "literal",
+                            "value": "Oostende"
+                        },
+                        "kind": {
+                            "type": "literal",
+                            "value": "candidate"
+                        }
+                    }
+                ]
+            }
+    """
+    result_format = helper_format.requested_format(req)
+    query = req.args.get('q', '')
+    kinds = req.args.getlist('type') or []
+    max_limit = int(environ.get('SEARCH_MAX_LIMIT', 100))
+    try:
+        limit = int(req.args.get('limit', 20))
+    except ValueError:
+        limit = 0
+    if (not query.strip() or result_format is None or not 0 < limit <= max_limit
+            or not all(kind in ('city', 'list', 'candidate') for kind in kinds)):
+        return json_response({'message': 'Wrong query parameters', 'success': False}, status=400)
+    index = await helper_index.search_index()
+    matches = index.search(query, limit=limit, kinds=set(kinds) or None)
+    body = helper_json.EncodedBody({
+        'success': True,
+        'result': helper_format.encode(matches, result_format)
+    })
+    return body.response(req, namespace='search')
 
 
-def get_web_ids():
+def get_web_ids(after_id=None, limit=None, since=None):
     """
-    Get all the webIDs in the database.
+    Get the webIDs in the database, ordered by id.
+
+    Keyword arguments:
+    after_id -- optional integer, only the entries with a higher id are returned.
+    limit -- optional integer, at most this many entries are returned.
+    since -- optional datetime, only the entries created at or after this date are returned.
 
     Returns:
     A list of dictionaries with keys "id", "uri", "lblod_id" and "date_created".
@@ -392,41 +1068,125 @@ def get_web_ids():
                 },
             ]
     """
-    web_ids = models.WebID.select()
+    query = (models.WebID
+             .select(models.WebID.id, models.WebID.uri, models.WebID.lblod_id, models.WebID.date_created)
+             .order_by(models.WebID.id))
+    if after_id is not None:
+        query = query.where(models.WebID.id > after_id)
+    if since is not None:
+        query = query.where(models.WebID.date_created >= since)
+    if limit is not None:
+        query = query.limit(limit)
+
+    # Read the rows as tuples instead of model instances and convert the datetime to an ISO 8601 string
+    return [{
+        'id': web_id,
+        'uri': uri,
+        'lblod_id': lblod_id,
+        'date_created': date_created.isoformat()
+    } for web_id, uri, lblod_id, date_created in query.tuples()]
+
+
+def get_web_ids_version():
+    """
+    Get the version of the webIDs in the database.
 
-    # Convert list of ModelSelect objects to Python dicts
-    web_ids = [model_to_dict(web_id) for web_id in web_ids]
-    for web_id in web_ids:
-        # Convert Python datetime object to ISO 8601 string
-        web_id['date_created'] = web_id['date_created'].isoformat()
-    return web_ids
+    Entries are only ever added, so the highest id and the number of entries change whenever the table changes.
 
+    Returns:
+    A tuple of the highest id and the number of entries.
+    """
+    return models.WebID.select(fn.MAX(models.WebID.id), fn.COUNT(models.WebID.id)).tuples().get()
 
-def get_web_id(lblod_id):
+
+def get_web_id_conflicts(uri, lblod_id):
     """
-    Get the webID uri for a given lblod id.
+    Get the stored pairs that use a webID uri or an lblod ID.
 
     Keyword arguments:
-    lblod_id -- string that represents the lblod ID that is stored in the database.
-        This function will raise a "DoesNotExist" exception when no entry in the database contains the ID.
+    uri -- string that represents a webID uri.
+    lblod_id -- string that represents an lblod ID.
 
-    Returns
-    A string that contains the webID uri of the entry in the database that matches the given lblod ID.
+    Returns:
+    A dictionary that maps the tuple of webID uri and lblod ID of every entry that contains the uri or the lblod ID
+        to the date on which the entry was created.
     """
-    web_id = models.WebID.get(models.WebID.lblod_id == lblod_id)
-    return web_id.uri
+    query = (models.WebID
+             .select(models.WebID.uri, models.WebID.lblod_id, models.WebID.date_created)
+             .where((models.WebID.uri == uri) | (models.WebID.lblod_id == lblod_id))
+             .tuples())
+    return {(uri, lblod_id): date_created for uri, lblod_id, date_created in query}
+
+
+def insert_web_ids(pairs):
+    """
+    Insert multiple webIDs with a single query, skipping the pairs of which the uri or lblod ID is already stored.
+
+    Keyword arguments:
+    pairs -- list of tuples of a webID uri and an lblod ID.
+
+    Returns:
+    A set with the tuples of webID uri and lblod ID that were inserted.
+    """
+    if not pairs:
+        return set()
+    query = (models.WebID
+             .insert_many(pairs, fields=[models.WebID.uri, models.WebID.lblod_id])
+             .on_conflict_ignore()
+             .returning(models.WebID.uri, models.WebID.lblod_id)
+             .tuples())
+    return set(query.execute())
+
+
+def get_web_id_map(lblod_ids):
+    """
+    Get the webID uris for multiple lblod ids with a single query.
+
+    Keyword arguments:
+    lblod_ids -- iterable of strings that represent lblod IDs that may be stored in the database.
+
+    Returns:
+    A dictionary that maps every given lblod ID that is stored in the database to the uri of its webID.
+        lblod IDs without an entry in the database are not present in the dictionary.
+    """
+    lblod_ids = list(set(lblod_ids))
+    if not lblod_ids:
+        return {}
+    query = (models.WebID
+             .select(models.WebID.lblod_id, models.WebID.uri)
+             .where(models.WebID.lblod_id.in_(lblod_ids))
+             .tuples())
+    return dict(query)
+
+
+async def add_web_ids(rows, key):
+    """
+    Add the linked webID to SPARQL result rows that describe a person.
+
+    Keyword arguments:
+    rows -- list of SPARQL bindings, these are not modified since they can be shared with the cache.
+    key -- name of the binding in every row that contains the URI of the person.
+
+    Returns:
+    A copy of the rows where every row of which the person has a webID in the database contains an extra binding
+    "webID" of type "literal" with the webID uri as value.
+    """
+    web_ids = await models.run_in_db(get_web_id_map, [row[key]['value'] for row in rows])
+    result = []
+    for row in rows:
+        row = dict(row)
+        web_id_uri = web_ids.get(row[key]['value'])
+        if web_id_uri is not None:
+            row['webID'] = {
+                'type': 'literal',
+                'value': web_id_uri
+            }
+        result.append(row)
+    return result
 
 
 if __name__ == '__main__':
-    # Connect to database & create tables if necessary
-    for i in range(1, 101):
-        try:
-            models.db.create_tables([models.WebID])
-            break
-        except OperationalError:
-            sys.stderr.write(f'Could not connect to postgres database, retrying... (attempt {i}/30)\n')
-            sys.stderr.flush()
-            sleep(0.5)
-
-    models.db.close()
-    app.run(host='0.0.0.0', port=8000, debug=environ.get('DEBUG'))
+    # Every worker connects to the database and applies the migrations in the background after the fork, see /readyz.
+    # Debug mode defaults to a single worker, since the automatic reloader only supports one.
+    workers = environ.get('WORKERS') or (1 if environ.get('DEBUG') else cpu_count() or 1)
+    app.run(host='0.0.0.0', port=8000, debug=environ.get('DEBUG'), workers=int(workers))
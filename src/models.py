@@ -1,20 +1,38 @@
 """
 Postgresql database models.
 """
-from peewee import Model, PostgresqlDatabase, CharField, DateTimeField
+from peewee import Model, CharField, DateTimeField, IntegerField, IntegrityError, PostgresqlDatabase
+from playhouse.pool import PooledPostgresqlDatabase
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import datetime
 
+import helper_metrics
+
 from os import environ
 
-db = PostgresqlDatabase(host=environ.get('PG_HOST'),
-                        database=environ.get('PG_DBNAME'),
-                        user=environ.get('PG_USER'),
-                        password=environ.get('PG_PASS'),
-                        autorollback=True)
+POOL_SIZE = int(environ.get('PG_POOL_SIZE', 10))
+
+# Connections are handed out from a pool and recycled after they have been idle for PG_POOL_TIMEOUT seconds.
+db = PooledPostgresqlDatabase(host=environ.get('PG_HOST'),
+                              database=environ.get('PG_DBNAME'),
+                              user=environ.get('PG_USER'),
+                              password=environ.get('PG_PASS'),
+                              max_connections=POOL_SIZE,
+                              stale_timeout=int(environ.get('PG_POOL_TIMEOUT', 300)),
+                              timeout=int(environ.get('PG_POOL_WAIT', 10)),
+                              autorollback=True)
+
+# Peewee is blocking, so queries run in these threads instead of on the event loop.
+# There is one thread per pooled connection, so a query never has to wait for a connection to become available.
+# The threads are created by `open_pool` in every worker, since threads don't survive a fork.
+_executor = None
 
-# NOTE: peewee unfortunately does not support automatic schema migrations, so we have to handle this manually if we change a model.
-# Fortunately the data we're storing is pretty simple, so this shouldn't happen a lot.
-# If this does become an issue there are modules to handle this automatically, but I haven't been able to find one that is actively developed.
+# NOTE: peewee doesn't generate schema migrations, so every change to a model needs a new entry in MIGRATIONS below.
+# `migrate` applies the entries that haven't been applied yet when a worker starts up.
+
+# Key of the Postgres advisory lock that keeps workers from migrating at the same time
+MIGRATION_LOCK = 4247
 
 
 class BaseModel(Model):
@@ -34,3 +52,125 @@ class WebID(BaseModel):
     uri = CharField(unique=True)
     lblod_id = CharField(unique=True)
     date_created = DateTimeField(default=datetime.datetime.now)
+
+
+class SchemaVersion(BaseModel):
+    """
+    The migrations that have been applied to the database.
+
+    "version" -- The version of the applied migration, see MIGRATIONS.
+    "applied" -- The date on which the migration was applied.
+    """
+    version = IntegerField(primary_key=True)
+    applied = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'schema_version'
+
+
+def create_web_id_table():
+    """
+    Create the webid table if it doesn't exist yet, as it was created before there were migrations.
+
+    The DDL is the one peewee generated for the original WebID model, instead of generating it from the current model,
+    so this migration doesn't change when the model does.
+    """
+    if isinstance(db, PostgresqlDatabase):
+        db.execute_sql('CREATE TABLE IF NOT EXISTS "webid" ("id" SERIAL NOT NULL PRIMARY KEY, '
+                       '"uri" VARCHAR(255) NOT NULL, "lblod_id" VARCHAR(255) NOT NULL, '
+                       '"date_created" TIMESTAMP NOT NULL)')
+    else:
+        db.execute_sql('CREATE TABLE IF NOT EXISTS "webid" ("id" INTEGER NOT NULL PRIMARY KEY, '
+                       '"uri" VARCHAR(255) NOT NULL, "lblod_id" VARCHAR(255) NOT NULL, '
+                       '"date_created" DATETIME NOT NULL)')
+    db.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS "webid_uri" ON "webid" ("uri")')
+    db.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS "webid_lblod_id" ON "webid" ("lblod_id")')
+
+
+def create_covering_indexes():
+    """
+    Index the lookups of webIDs so they are answered from the index alone.
+
+    The lookup of the webID of an lblod ID reads the uri from an index on (lblod_id) INCLUDE (uri), and the listing
+    of the webIDs created since a date scans an index on date_created. INCLUDE needs Postgres 11, other databases get
+    an index on both columns instead.
+    """
+    if isinstance(db, PostgresqlDatabase):
+        db.execute_sql('CREATE INDEX IF NOT EXISTS webid_lblod_id_covering ON webid (lblod_id) INCLUDE (uri)')
+    else:
+        db.execute_sql('CREATE INDEX IF NOT EXISTS webid_lblod_id_covering ON webid (lblod_id, uri)')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS webid_date_created ON webid (date_created)')
+
+
+# Schema changes in the order they are applied, as tuples of a version and a function that applies the change.
+# Applied migrations must never change, add a new version instead.
+MIGRATIONS = [
+    (1, create_web_id_table),
+    (2, create_covering_indexes),
+]
+
+
+def migrate():
+    """
+    Apply the migrations that haven't been applied to the database yet, in a single transaction.
+
+    Returns:
+    A list with the versions of the migrations that were applied.
+    """
+    with db.atomic():
+        if isinstance(db, PostgresqlDatabase):
+            # Waits for the other workers, which see the migrations as applied once they get the lock
+            db.execute_sql('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK, ))
+        db.create_tables([SchemaVersion])
+        applied = {version for version, in SchemaVersion.select(SchemaVersion.version).tuples()}
+        versions = []
+        for version, migration in MIGRATIONS:
+            if version not in applied:
+                migration()
+                SchemaVersion.create(version=version)
+                versions.append(version)
+        return versions
+
+
+def open_pool():
+    """Create the threads that run the database queries of this worker."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='db')
+
+
+def close_pool():
+    """Wait for the running database queries to finish, then close all connections in the pool."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    db.close_all()
+
+
+async def run_in_db(func, *args):
+    """
+    Run a blocking database function in a worker thread with a connection from the pool.
+
+    Keyword arguments:
+    func -- function that queries the database, the connection is returned to the pool once it has finished.
+    args -- positional arguments that are passed to the function.
+
+    Returns:
+    The return value of the function. Exceptions raised by the function are propagated.
+    """
+    def run():
+        with db.connection_context():
+            return func(*args)
+
+    if _executor is None:
+        open_pool()
+    with helper_metrics.DB_DURATION.time(func.__name__):
+        try:
+            return await asyncio.get_event_loop().run_in_executor(_executor, run)
+        except IntegrityError:
+            # Violated unique constraints are expected, they are reported to the client
+            raise
+        except Exception:
+            helper_metrics.DB_ERRORS.inc(func.__name__)
+            raise
@@ -0,0 +1,66 @@
+"""
+Shared fixtures of the unit tests.
+
+The tests import the modules of the API from src, like serve.py does when it runs from that directory.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import helper_snapshot  # noqa: E402
+
+
+class Clock:
+    """Replacement of the time module of which the monotonic clock only moves when it is advanced."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def binding(variable, value):
+    """Build a SPARQL binding for a variable."""
+    return {'type': helper_snapshot.binding_type(variable), 'value': value}
+
+
+def row(**values):
+    """Build a row of SPARQL bindings."""
+    return {variable: binding(variable, value) for variable, value in values.items()}
+
+
+@pytest.fixture
+def tables():
+    """A small election: the bindings of every table in helper_snapshot.TABLES, by name."""
+    gent = 'http://data.lblod.info/id/werkingsgebieden/gent'
+    aalst = 'http://data.lblod.info/id/werkingsgebieden/aalst'
+    lists = [(gent, 'http://data.lblod.info/id/kandidatenlijsten/gent-1', 'Groen'),
+             (gent, 'http://data.lblod.info/id/kandidatenlijsten/gent-2', 'Open Vld'),
+             (aalst, 'http://data.lblod.info/id/kandidatenlijsten/aalst-1', 'Groen')]
+    candidates = [(lists[0][1], 'http://data.lblod.info/id/personen/1', 'Tom', 'Peeters'),
+                  (lists[0][1], 'http://data.lblod.info/id/personen/2', 'Élise', 'Van Damme'),
+                  (lists[1][1], 'http://data.lblod.info/id/personen/3', 'Tommy', 'Janssens'),
+                  (lists[2][1], 'http://data.lblod.info/id/personen/4', 'Sofie', 'Gentil'),
+                  (lists[2][1], 'http://data.lblod.info/id/personen/1', 'Tom', 'Peeters')]
+    return {
+        'cities': [row(cityURI=gent, cityName='Gent', locationLabel='Gemeente'),
+                   row(cityURI=aalst, cityName='Aalst', locationLabel='Gemeente')],
+        'lists': [row(cityURI=city, listURI=uri, listName=name) for city, uri, name in lists],
+        'candidates': [row(listURI=list_uri, personURI=person, name=name, familyName=family_name)
+                       for list_uri, person, name, family_name in candidates],
+        'list_numbers': [row(listURI=uri, listName=name, trackingNb=str(number))
+                         for number, (_, uri, name) in enumerate(lists, 1)],
+        'persons': [row(personURI=person) for person in sorted({person for _, person, _, _ in candidates})]
+    }
@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+import helper_cache
+from helper_cache import TTLCache
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch, clock):
+    monkeypatch.setattr(helper_cache, 'time', clock)
+
+
+class Upstream:
+    """Computes values that are released by the test, counting the computations."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def compute(self):
+        self.calls += 1
+        await self.release.wait()
+        return f'value {self.calls}'
+
+
+def test_set_and_get():
+    cache = TTLCache(10)
+    cache.set(('cities', ), 'value', 60)
+    assert cache.get(('cities', )) == 'value'
+    assert cache.get(('lists', 'http://x/city')) is None
+
+
+def test_expiry(clock):
+    cache = TTLCache(10)
+    cache.set(('cities', ), 'value', 60)
+    clock.advance(59)
+    assert cache.get(('cities', )) == 'value'
+    clock.advance(1)
+    assert cache.get(('cities', )) is None
+    assert len(cache) == 0
+
+
+def test_disabled():
+    cache = TTLCache(0)
+    cache.set(('cities', ), 'value', 60)
+    assert cache.get(('cities', )) is None
+    cache = TTLCache(10)
+    cache.set(('cities', ), 'value', 0)
+    assert cache.get(('cities', )) is None
+
+
+def test_lru_eviction():
+    cache = TTLCache(2)
+    cache.set(('lists', 'a'), 'a', 60)
+    cache.set(('lists', 'b'), 'b', 60)
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get(('lists', 'a')) == 'a'
+    cache.set(('lists', 'c'), 'c', 60)
+    assert cache.get(('lists', 'b')) is None
+    assert cache.get(('lists', 'a')) == 'a'
+    assert cache.get(('lists', 'c')) == 'c'
+    assert len(cache) == 2
+
+
+def test_invalidate():
+    cache = TTLCache(10)
+    cache.set(('lists', 'a'), 'a', 60)
+    cache.set(('lists', 'b'), 'b', 60)
+    cache.set(('cities', ), 'cities', 60)
+    assert cache.invalidate(where=lambda key: key[-1] == 'a') == 1
+    assert cache.invalidate('lists') == 1
+    assert cache.get(('cities', )) == 'cities'
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def test_coalescing():
+    async def run():
+        cache = TTLCache(10)
+        upstream = Upstream()
+        lookups = [asyncio.ensure_future(cache.get_or_compute(('cities', ), 60, upstream.compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*lookups)
+        assert results == ['value 1'] * 5
+        assert upstream.calls == 1
+        assert await cache.get_or_compute(('cities', ), 60, upstream.compute) == 'value 1'
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats['misses'] == {'cities': 1}
+    assert stats['coalesced'] == {'cities': 4}
+    assert stats['hits'] == {'cities': 1}
+
+
+def test_cancelled_lookup_does_not_cancel_the_computation():
+    async def run():
+        cache = TTLCache(10)
+        upstream = Upstream()
+        first = asyncio.ensure_future(cache.get_or_compute(('cities', ), 60, upstream.compute))
+        second = asyncio.ensure_future(cache.get_or_compute(('cities', ), 60, upstream.compute))
+        await asyncio.sleep(0)
+        # The first lookup started the computation, its client disconnects
+        first.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        assert await second == 'value 1'
+        assert first.cancelled()
+        assert upstream.calls == 1
+        assert cache.get(('cities', )) == 'value 1'
+
+    asyncio.run(run())
+
+
+def test_cancelled_lookup_still_stores_the_value():
+    async def run():
+        cache = TTLCache(10)
+        upstream = Upstream()
+        lookup = asyncio.ensure_future(cache.get_or_compute(('cities', ), 60, upstream.compute))
+        await asyncio.sleep(0)
+        lookup.cancel()
+        upstream.release.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert cache.get(('cities', )) == 'value 1'
+
+    asyncio.run(run())
+
+
+def test_failure_is_propagated_and_not_cached():
+    async def fail():
+        raise RuntimeError('upstream failed')
+
+    async def run():
+        cache = TTLCache(10)
+        lookups = [asyncio.ensure_future(cache.get_or_compute(('cities', ), 60, fail)) for _ in range(3)]
+        results = await asyncio.gather(*lookups, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert len(cache) == 0
+        assert not cache._pending
+
+    asyncio.run(run())
+
+
+def test_stale_window(clock):
+    async def run():
+        cache = TTLCache(10, stale=100)
+        upstream = Upstream()
+        upstream.release.set()
+        assert await cache.get_or_compute(('cities', ), 60, upstream.compute) == 'value 1'
+
+        clock.advance(61)
+        assert cache.get(('cities', )) is None
+        assert cache.get_stale(('cities', )) == 'value 1'
+        # The stale value is served right away and refreshed in the background
+        upstream.release.clear()
+        helper_cache.served_stale.set(False)
+        assert await cache.get_or_compute(('cities', ), 60, upstream.compute) == 'value 1'
+        assert helper_cache.served_stale.get()
+        assert await cache.get_or_compute(('cities', ), 60, upstream.compute) == 'value 1'
+        await asyncio.sleep(0)
+        assert upstream.calls == 2
+        upstream.release.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert cache.get(('cities', )) == 'value 2'
+
+        # Past the stale window the lookup waits for the new value
+        clock.advance(161)
+        assert cache.get_stale(('cities', )) is None
+        assert await cache.get_or_compute(('cities', ), 60, upstream.compute) == 'value 3'
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats['stale_hits'] == {'cities': 2}
+    assert stats['misses'] == {'cities': 2}
@@ -0,0 +1,96 @@
+import pytest
+
+import helper_index
+import helper_search
+import helper_snapshot
+from helper_search import SearchIndex
+
+
+# Variables of the searched name of every kind of result
+NAME = {'city': ('cityName', ), 'list': ('listName', ), 'candidate': ('name', 'familyName')}
+
+
+def names(results):
+    return [' '.join(result[variable]['value'] for variable in NAME[result['kind']['value']]) for result in results]
+
+
+@pytest.fixture
+def index(tables):
+    return helper_index.ElectionIndex(*(tables[name] for name, _, _ in helper_snapshot.TABLES))
+
+
+@pytest.fixture
+def search(index):
+    return helper_search.build(index)
+
+
+def test_normalize():
+    assert helper_search.normalize('Sint-Niklaas') == ['sint', 'niklaas']
+    assert helper_search.normalize('  Élise VAN-damme ') == ['elise', 'van', 'damme']
+    assert helper_search.normalize('--') == []
+
+
+def test_documents(index):
+    docs = helper_search.documents(index)
+    assert len(docs) == 2 + 3 + 5
+    gent = 'http://data.lblod.info/id/werkingsgebieden/gent'
+    assert docs[('city', gent)] == ('city', gent, 'Gent', 'Gemeente')
+
+
+def test_result_rows(search):
+    [result] = search.search('elise')
+    assert result == {
+        'personURI': {'type': 'uri', 'value': 'http://data.lblod.info/id/personen/2'},
+        'name': {'type': 'literal', 'value': 'Élise'},
+        'familyName': {'type': 'literal', 'value': 'Van Damme'},
+        'listURI': {'type': 'uri', 'value': 'http://data.lblod.info/id/kandidatenlijsten/gent-1'},
+        'listName': {'type': 'literal', 'value': 'Groen'},
+        'cityURI': {'type': 'uri', 'value': 'http://data.lblod.info/id/werkingsgebieden/gent'},
+        'cityName': {'type': 'literal', 'value': 'Gent'},
+        'kind': {'type': 'literal', 'value': 'candidate'}
+    }
+
+
+def test_ranking(search):
+    # A whole word ranks above a prefix, and shorter names rank first
+    assert names(search.search('gent')) == ['Gent', 'Sofie Gentil']
+    assert names(search.search('tom')) == ['Tom Peeters', 'Tom Peeters', 'Tommy Janssens']
+    # Every word of the query has to match
+    assert names(search.search('tom pee')) == ['Tom Peeters', 'Tom Peeters']
+    assert search.search('tom gent') == []
+
+
+def test_fuzzy(search):
+    assert names(search.search('peters')) == ['Tom Peeters', 'Tom Peeters']
+    assert search.search('peters', fuzzy=False) == []
+    assert search.search('xyz') == []
+
+
+def test_kinds_and_limit(search):
+    assert names(search.search('groen', kinds={'list'})) == ['Groen', 'Groen']
+    assert names(search.search('g', kinds={'city'})) == ['Gent']
+    assert len(search.search('g', limit=1)) == 1
+
+
+def test_update(search, index, tables):
+    docs = helper_search.documents(index)
+    gent = 'http://data.lblod.info/id/werkingsgebieden/gent'
+    aalst = 'http://data.lblod.info/id/werkingsgebieden/aalst'
+    del docs[('city', aalst)]
+    docs[('city', gent)] = ('city', gent, 'Gent-Brugge', 'Gemeente')
+    docs[('city', 'http://x/city')] = ('city', 'http://x/city', 'Brugge', 'Gemeente')
+
+    updated = search.copy()
+    assert updated.update(docs) == (1, 1, 1)
+    assert names(updated.search('brugge')) == ['Brugge', 'Gent-Brugge']
+    assert updated.search('aalst', kinds={'city'}) == []
+    assert updated.version == search.version + 1
+    # The index that answers searches is not modified
+    assert names(search.search('aalst', kinds={'city'})) == ['Aalst']
+    assert search.search('brugge') == []
+    assert updated.update(docs) == (0, 0, 0)
+
+
+def test_empty():
+    assert SearchIndex().search('gent') == []
+    assert len(SearchIndex()) == 0
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import helper_index
+import helper_snapshot
+from helper_snapshot import SnapshotIndex
+
+
+def results(tables):
+    return [tables[name] for name, _, _ in helper_snapshot.TABLES]
+
+
+def rows(bindings):
+    """Sort rows, since the snapshot orders them on their string IDs."""
+    return sorted(bindings, key=lambda row: sorted((key, binding['value']) for key, binding in row.items()))
+
+
+def test_round_trip(tmp_path, tables):
+    path = tmp_path / 'lblod.snapshot'
+    helper_snapshot.write(str(path), results(tables))
+    snapshot = SnapshotIndex(str(path))
+    index = helper_index.ElectionIndex(*results(tables))
+
+    assert rows(snapshot.cities()) == rows(index.cities())
+    for city in index.cities():
+        city_uri = city['cityURI']['value']
+        assert rows(snapshot.lists(city_uri)) == rows(index.lists(city_uri))
+        for list_row in index.lists(city_uri):
+            list_uri = list_row['listURI']['value']
+            assert rows(snapshot.candidates(list_uri)) == rows(index.candidates(list_uri))
+            assert rows(snapshot.list_numbers(list_uri)) == rows(index.list_numbers(list_uri))
+    for person in tables['persons']:
+        person_uri = person['personURI']['value']
+        assert snapshot.person_exists(person_uri)
+        assert rows(snapshot.person_info(person_uri)) == rows(index.person_info(person_uri))
+
+    assert snapshot.lists('http://data.lblod.info/id/werkingsgebieden/unknown') == []
+    assert snapshot.person_info('http://data.lblod.info/id/personen/unknown') == []
+    assert not snapshot.person_exists('http://data.lblod.info/id/personen/unknown')
+    assert not snapshot.person_exists(tables['cities'][0]['cityURI']['value'])
+    assert snapshot.stats()['candidates'] == len(tables['candidates'])
+
+
+def test_replace_while_mapped(tmp_path, tables):
+    path = tmp_path / 'lblod.snapshot'
+    helper_snapshot.write(str(path), results(tables))
+    old = SnapshotIndex(str(path))
+    cities = old.cities()
+
+    smaller = dict(tables, cities=tables['cities'][:1])
+    helper_snapshot.write(str(path), results(smaller))
+
+    # The mapped snapshot keeps answering from the replaced file, the new one is only seen when mapped again
+    assert rows(old.cities()) == rows(cities)
+    assert len(SnapshotIndex(str(path)).cities()) == 1
+    assert os.listdir(tmp_path) == ['lblod.snapshot']
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'lblod.snapshot'
+    path.write_bytes(b'\0' * helper_snapshot.HEADER.size)
+    with pytest.raises(ValueError):
+        SnapshotIndex(str(path))
@@ -0,0 +1,89 @@
+import pytest
+
+import helper_sparql
+from helper_sparql import CircuitBreaker
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch, clock):
+    monkeypatch.setattr(helper_sparql, 'time', clock)
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(3, 30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert not breaker.is_open
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+
+def test_success_resets_the_failures():
+    breaker = CircuitBreaker(3, 30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_single_trial_after_cooldown(clock):
+    breaker = CircuitBreaker(1, 30)
+    breaker.record_failure()
+    clock.advance(29)
+    assert not breaker.allow()
+    assert breaker.retry_after() == 1
+    clock.advance(1)
+    # Half-open: only one query is let through until it has an outcome
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.is_open
+
+
+def test_successful_trial_closes(clock):
+    breaker = CircuitBreaker(1, 30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow()
+    assert breaker.allow()
+    assert breaker.retry_after() == 0
+
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(5, 30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+    # A failed trial opens the circuit again for a full cooldown, whatever the threshold
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+
+def test_ended_trial_lets_the_next_query_through(clock):
+    breaker = CircuitBreaker(1, 30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+    # The trial query was cancelled before it had an outcome
+    breaker.end_trial()
+    assert breaker.is_open
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_disabled():
+    breaker = CircuitBreaker(0, 30)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow()